@@ -2,10 +2,13 @@
 
 import numpy as np
 
+from sts2.game.game_state import GameState
+from sts2.game.settings import TeamSide
+
 
 def format_state(game):
     # Fields supported by the game directly
-    state = {field: game.state.series[field] for field in game.state.series.index}
+    state = game.state.GetNamedSnapshot()
 
     # Additional custom fields:
     state['tick'] = game.tick
@@ -20,37 +23,133 @@ def format_state(game):
 
     # Scoring probabilities for all the players, computed by the game.
     state['score_prob'] = {}
-    for player in game.players:
-        prob = game.PlayerShot(player, True, 0)
-        state['score_prob'][player.name] = prob
+    for player, prob in zip(game.players, game.PlayerShotChances(game.players)):
+        state['score_prob'][player.name] = float(prob)
 
     return state
 
 
+class ObservationMode:
+    DICT = 'dict'  # format_state dicts
+    FLAT = 'flat'  # float32 vectors in ObservationSchema layout, see format_flat_state
+
+
+class ObservationSchema(object):
+    """
+    Layout of the flat observations: offsets maps every field name to its column. The columns are
+    the tick, the state fields that can change during a game and the scoring chance of every
+    player ('<prefix>_score_prob'). The values that never change (arena bounds, nets, rosters) are
+    not in the vector, they are in static, with the teams and prefixes maps of format_state.
+
+    The vector is float32, which holds integers exactly up to 2 ** 24: ticks past 16777216 are
+    rounded (game.tick stays exact). Games that long should take the tick from the game.
+    """
+    STATIC_FIELDS = [GameState.ARENA_MIN_X, GameState.ARENA_MAX_X, GameState.ARENA_MIN_Z,
+                     GameState.ARENA_MAX_Z]
+    STATIC_TEAM_FIELDS = [GameState.TEAM_NET_X, GameState.TEAM_NET_Z, GameState.TEAM_ATTACK_Z,
+                          GameState.TEAM_PLAYERS]
+    STATIC_PLAYER_FIELDS = [GameState.PLAYER_NAME, GameState.PLAYER_IS_HUMAN]
+    SCORE_PROB = '_score_prob'
+
+    def __init__(self, game):
+        state = game.state
+        static_fields = list(self.STATIC_FIELDS)
+        for teamside in TeamSide.TEAMSIDES:
+            static_fields += [state.GetTeamFieldName(teamside, field)
+                              for field in self.STATIC_TEAM_FIELDS]
+        for player in game.players:
+            prefix = state.GetPlayerFieldPrefix(player)
+            static_fields += [prefix + field for field in self.STATIC_PLAYER_FIELDS]
+
+        self.static = {field: state.GetField(field) for field in static_fields}
+        self.static['teams'] = [[player.name for player in team] for team in game.team_players]
+        self.static['prefixes'] = {player.name: state.GetPlayerFieldPrefix(player)
+                                   for player in game.players}
+
+        # tuple, so it can key the compiled positions of GameState.GetFieldValues
+        self.state_fields = tuple(field for field in state.GetFieldNames()
+                                  if field not in self.static)
+        self.fields = [GameState.TICK] + list(self.state_fields) + [
+            state.GetPlayerFieldPrefix(player) + self.SCORE_PROB for player in game.players]
+        self.offsets = {field: offset for offset, field in enumerate(self.fields)}
+        self.size = len(self.fields)
+
+
+def format_flat_state(game, schema, out):
+    """
+    Writes the observation into the float32 vector out, in schema layout. Actions and phases are
+    codes. Same values as format_state, without the static ones.
+    """
+    num_state_fields = len(schema.state_fields)
+    out[0] = game.tick
+    game.state.GetFieldValues(schema.state_fields, out[1:num_state_fields + 1])
+    out[num_state_fields + 1:] = game.PlayerShotChances(game.players)
+    return out
+
+
 class ClientAdapter(object):
     def __init__(self, game):
         self.game = game
 
         self.action = None
         self.state = None
+        self.observation_schema = None
+
+        # agent players in action batch order, see set_agents
+        self.agent_slots = {}
+        self.action_ids = None
+        self.action_inputs = None
+
+    def set_agents(self, agents):
+        """Fixes the order of the agent players in the action batches of receive_action."""
+        self.agent_slots = {agent: slot for slot, agent in enumerate(agents)}
 
     def receive_action(self, action):
-        """ Custom handling. """
+        """
+        Custom handling. action is a dict of player name -> {'action': name, 'input': [x, z]}, or
+        an action batch: a tuple of an int array of action codes and a (num_agents, 2) input array,
+        in set_agents order.
+        """
+        if isinstance(action, tuple):
+            self.action = {}
+            self.action_ids, self.action_inputs = action
+            assert (len(self.action_ids) == len(self.agent_slots))
+            assert (np.shape(self.action_inputs) == (len(self.agent_slots), 2))
+            return
+        self.action_ids = None
+        self.action_inputs = None
         self.action = action if action else {}
 
         # Check if the external app wants the game to load a specific state
         load_state = self.action.get("load_state")
         if load_state is not None:
-            for key in self.game.state.series.index:
-                self.game.state.SetField(key, load_state[key])
+            self.game.state.SetFromSnapshot(
+                {key: load_state[key] for key in self.game.state.GetFieldNames()})
 
     def unpack_action(self, player):
+        # the action is a code with action batches, a name or None otherwise
+        if self.action_ids is not None:
+            slot = self.agent_slots[player]
+            return int(self.action_ids[slot]), self.action_inputs[slot]
         player_dct = self.action.get(player.name, {})
         # TODO: Here is an opportunity to run all kind of checks on the action and input.
         discrete_action = player_dct.get('action', None)
         continuous_input = np.array(player_dct.get('input', np.zeros(2)))
         return discrete_action, continuous_input
 
-    def send_state(self):
-        self.state = format_state(self.game)
+    def get_observation_schema(self):
+        # the layout only depends on the rosters, it is built once
+        if self.observation_schema is None:
+            self.observation_schema = ObservationSchema(self.game)
+        return self.observation_schema
+
+    def send_state(self, out=None):
+        """
+        Returns the format_state dict, or when a float32 vector out is given, writes the flat
+        observation of get_observation_schema() layout into it and returns out.
+        """
+        if out is not None:
+            self.state = format_flat_state(self.game, self.get_observation_schema(), out)
+        else:
+            self.state = format_state(self.game)
         return self.state
@@ -0,0 +1,129 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+"""
+Headless data collection over a process pool:
+
+    python -m sts2.collect --games N --workers W --rules DATACOLLECTION_GAME_RULES --out DIR
+
+Game i is played with seed --seed + i, by worker i % W. Every worker writes its games to one
+shard, a columnar state history file (see sts2.game.columnar_history) with the games one after the
+other. manifest.json lists the shards and where each game starts in them.
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import time
+
+from sts2.environment import STS2Environment
+from sts2.game import rules as game_rules
+from sts2.game.columnar_history import WriteColumnarHistory
+from sts2.game.game_state import ArrayGameState
+from sts2.game.simulation import HistoryMode
+
+SHARD_FILE = 'shard_%03d.npz'
+MANIFEST_FILE = 'manifest.json'
+
+
+def get_rules(name):
+    rules = getattr(game_rules, name, None)
+    if not isinstance(rules, game_rules.Rules):
+        raise ValueError('unknown rules %s' % name)
+    return rules
+
+
+def play_game(env, seed):
+    # plays one game to GAME_OVER, returns the (ticks, rows) of its state history; nobody looks at
+    # the observations, so the game is updated directly instead of through env.step
+    env.seed(seed)
+    env.reset()
+    game = env.game
+    while not game.IsSimulationComplete():
+        game.update()
+    history = game.game_state_history
+    return [entry.tick for entry in history], [entry.state.to_numpy(dtype=object)
+                                               for entry in history]
+
+
+def collect_shard(shard, seeds, env_kwargs, out_dir):
+    """Plays the games of seeds in one env and writes them to the shard file, returns its manifest."""
+    env = STS2Environment(**env_kwargs)
+    file_name = SHARD_FILE % shard
+    games = []
+    ticks = []
+    rows = []
+    for seed in seeds:
+        game_ticks, game_rows = play_game(env, seed)
+        games.append({'seed': seed, 'first_state': len(rows), 'num_states': len(game_rows)})
+        ticks += game_ticks
+        rows += game_rows
+    WriteColumnarHistory(os.path.join(out_dir, file_name), env.game.state.GetFieldNames(), rows,
+                         ticks)
+    return {'file': file_name, 'num_states': len(rows), 'games': games}
+
+
+def collect(num_games, num_workers, rules_name, out_dir, seed=0, env_kwargs=None):
+    """Plays num_games games over num_workers processes, returns the manifest."""
+    rules = get_rules(rules_name)
+    kwargs = dict(timeout_ticks=rules.max_tick)
+    kwargs.update(env_kwargs or {})
+    kwargs.update(rules=rules, state_cls=ArrayGameState, history_mode=HistoryMode.DELTA,
+                  save_states=False, with_pygame=False, turbo=False)
+
+    os.makedirs(out_dir, exist_ok=True)
+    num_workers = max(1, min(num_workers, num_games))
+    tasks = [(shard, list(range(seed + shard, seed + num_games, num_workers)), kwargs, out_dir)
+             for shard in range(num_workers)]
+
+    start = time.time()
+    with multiprocessing.Pool(num_workers) as pool:
+        shards = pool.starmap(collect_shard, tasks)
+    elapsed = time.time() - start
+
+    manifest = {
+        'created': datetime.datetime.now().isoformat(),
+        'rules': rules_name,
+        'env_kwargs': {key: value for key, value in kwargs.items()
+                       if key not in ('rules', 'state_cls')},
+        'seed': seed,
+        'num_games': num_games,
+        'num_workers': num_workers,
+        'num_states': sum(shard['num_states'] for shard in shards),
+        'seconds': elapsed,
+        'shards': shards,
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as fout:
+        json.dump(manifest, fout, indent=1)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sts2.collect',
+                                     description='Parallel headless data collection.')
+    parser.add_argument('--games', type=int, required=True, help='number of games to play')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes, one shard each (default: all the cores)')
+    parser.add_argument('--rules', default='DATACOLLECTION_GAME_RULES',
+                        help='name of the rules in sts2.game.rules')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('--timeout-ticks', type=int, default=None,
+                        help='game length (default: max_tick of the rules)')
+    parser.add_argument('--env', default='{}',
+                        help='JSON dict of extra STS2Environment options, e.g. the rosters')
+    args = parser.parse_args(argv)
+
+    env_kwargs = json.loads(args.env)
+    if args.timeout_ticks is not None:
+        env_kwargs['timeout_ticks'] = args.timeout_ticks
+
+    manifest = collect(args.games, args.workers, args.rules, args.out, args.seed, env_kwargs)
+    print('%d games, %d states in %d shards, %.1fs (%.0f states/s)' % (
+        manifest['num_games'], manifest['num_states'], len(manifest['shards']),
+        manifest['seconds'], manifest['num_states'] / manifest['seconds']))
+
+
+if __name__ == '__main__':
+    main()
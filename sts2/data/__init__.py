@@ -0,0 +1 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
\ No newline at end of file
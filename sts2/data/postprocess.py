@@ -0,0 +1,237 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+"""
+Ball trajectories for recorded state histories, on their columns:
+
+    python -m sts2.data.postprocess STATEHISTORY.npz STATEHISTORY_processed.npz
+
+The game has no ball, the player in control holds it. This adds ball_pos_x/z, ball_in_air and
+ball_vel_x/z to every state. During a pass the ball flies from the passer to where the receiver
+was for rules.airtime ticks, control is -1 meanwhile, and a failed pass ends where the ball first
+comes within rules.max_intercept_dist of the interceptor. Episodes end at a goal, including the
+GAME_OVER state of a game that ends with it (Rules.Termination.GOALS or EVERY_GOAL), or when a new
+game starts (the tick goes back); passes are cut at the end of their episode.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from sts2.game import rules as game_rules
+from sts2.game.columnar_history import ColumnarStateHistory, FieldKind, WriteColumns
+from sts2.game.game_state import Action, GameState
+from sts2.game.rules import DATACOLLECTION_GAME_RULES
+from sts2.game.settings import GamePhase, TeamSide
+
+BALL_FIELDS = [('ball_pos_x', FieldKind.FLOAT), ('ball_pos_z', FieldKind.FLOAT),
+               ('ball_in_air', FieldKind.BOOL), ('ball_vel_x', FieldKind.FLOAT),
+               ('ball_vel_z', FieldKind.FLOAT)]
+
+
+def get_player_slots(field_names):
+    """
+    Returns the player field prefixes ('home0', ...) and a (NUM_TEAMSIDES, max team size) array of
+    their indices in the prefixes, -1 where a team has no such player.
+    """
+    prefixes = []
+    team_slots = []
+    for teamside in TeamSide.TEAMSIDES:
+        slots = []
+        while TeamSide.GetName(teamside) + str(len(slots)) + GameState.PLAYER_POS_X in field_names:
+            slots.append(len(prefixes))
+            prefixes.append(TeamSide.GetName(teamside) + str(len(slots) - 1))
+        team_slots.append(slots)
+    lookup = np.full((TeamSide.NUM_TEAMSIDES, max(1, max(map(len, team_slots)))), -1, dtype=int)
+    for teamside, slots in enumerate(team_slots):
+        lookup[teamside, :len(slots)] = slots
+    return prefixes, lookup
+
+
+def split_episodes(phase, ticks=None, previous_phase=None):
+    """
+    Returns the (starts, ends, finished) arrays of the episodes: an episode ends with a goal, or
+    before a state whose known tick is not after the previous one. Only episodes that end with a
+    goal are finished.
+
+    A goal is a STOPPAGE_GOAL state, or, with previous_phase, the GAME_OVER state after it when the
+    goal ends the game. That state belongs to the episode of the goal. Older files may have the
+    GAME_OVER state without the STOPPAGE_GOAL one.
+    """
+    num_states = len(phase)
+    goal_end = phase == GamePhase.STOPPAGE_GOAL
+    if previous_phase is not None:
+        game_over = (phase == GamePhase.GAME_OVER) & (previous_phase == GamePhase.STOPPAGE_GOAL)
+        goal_end[:-1] &= ~game_over[1:]
+        goal_end |= game_over
+    new = np.zeros(num_states, dtype=bool)
+    new[:1] = True
+    new[1:] |= goal_end[:-1]
+    if ticks is not None:
+        known = (ticks[1:] >= 0) & (ticks[:-1] >= 0)
+        new[1:] |= known & (ticks[1:] <= ticks[:-1])
+    starts = np.flatnonzero(new)
+    ends = np.append(starts[1:], num_states).astype(starts.dtype)
+    finished = goal_end[ends - 1]
+    return starts, ends, finished
+
+
+def resolve_passes(starts, ends):
+    """
+    A pass can't start in the tick after one masked by an earlier pass (its control is -1 then),
+    takes the candidate passes in order and returns which of them happen. The loop is over passes
+    only, everything else is done for all of them at once.
+    """
+    accepted = np.zeros(len(starts), dtype=bool)
+    last_masked = -1
+    for k, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        if start - 1 > last_masked:
+            accepted[k] = True
+            last_masked = end
+    return accepted
+
+
+def compute_ball(columns, episode_starts, episode_ends, rules=DATACOLLECTION_GAME_RULES):
+    """
+    Computes the ball of the states of columns, encoded arrays as in ColumnarStateHistory, which
+    hold the given episodes back to back. Returns the ball columns and the control_team and
+    control_index columns, with -1 while the ball is in the air.
+    """
+    prefixes, lookup = get_player_slots(columns)
+    num_states = len(columns[GameState.CONTROL_TEAM])
+    states = np.arange(num_states)
+    pos_x = np.stack([columns[prefix + GameState.PLAYER_POS_X] for prefix in prefixes], axis=1)
+    pos_z = np.stack([columns[prefix + GameState.PLAYER_POS_Z] for prefix in prefixes], axis=1)
+    actions = np.stack([columns[prefix + GameState.PLAYER_ACTION] for prefix in prefixes], axis=1)
+    control_team = np.array(columns[GameState.CONTROL_TEAM], dtype=int)
+    control_index = np.array(columns[GameState.CONTROL_INDEX], dtype=int)
+
+    lengths = episode_ends - episode_starts
+    episode_start = np.repeat(episode_starts, lengths)
+    episode_end = np.repeat(episode_ends, lengths)
+
+    # possession: the ball is at the player in control
+    team_sizes = (lookup >= 0).sum(axis=1)
+    team = np.clip(control_team, 0, TeamSide.NUM_TEAMSIDES - 1)
+    valid = (control_team == team) & (control_index >= 0) & (control_index < team_sizes[team])
+    controller = np.where(valid, lookup[team, np.clip(control_index, 0, lookup.shape[1] - 1)], -1)
+    ball_x = np.where(valid, pos_x[states, controller], np.nan)
+    ball_z = np.where(valid, pos_z[states, controller], np.nan)
+    in_air = np.zeros(num_states, dtype=bool)
+
+    # candidate passes: the player in control in the previous tick of the episode passes
+    passes = np.flatnonzero((episode_start[1:] < states[1:]) & valid[:-1]) + 1
+    passer = controller[passes - 1]
+    action = actions[passes, passer].astype(int)
+    receiver_index = action - Action.PASS_1
+    passing_team = control_team[passes - 1]
+    is_pass = np.isin(action, Action.PASSES) & (receiver_index < team_sizes[team[passes - 1]])
+    passes, passer, receiver_index, passing_team = (
+        passes[is_pass], passer[is_pass], receiver_index[is_pass], passing_team[is_pass])
+    receiver = lookup[passing_team, receiver_index]
+    successful = (control_team[passes] == passing_team) & (control_index[passes] == receiver_index)
+    interceptor = controller[passes]
+
+    # flight of every candidate, cut at the end of its episode
+    steps = np.arange(1, max(1, rules.airtime))
+    flight = passes[:, None] + steps
+    in_episode = flight < episode_end[passes][:, None]
+    flight = np.minimum(flight, num_states - 1)
+    diff_x = pos_x[passes, receiver] - pos_x[passes, passer]
+    diff_z = pos_z[passes, receiver] - pos_z[passes, passer]
+    flight_x = pos_x[passes, passer][:, None] + diff_x[:, None] * steps / rules.airtime
+    flight_z = pos_z[passes, passer][:, None] + diff_z[:, None] * steps / rules.airtime
+
+    # a failed pass is intercepted where the ball first gets close enough to the interceptor
+    to_interceptor_x = flight_x - pos_x[flight, interceptor[:, None]]
+    to_interceptor_z = flight_z - pos_z[flight, interceptor[:, None]]
+    close = np.sqrt(to_interceptor_x ** 2 + to_interceptor_z ** 2) < rules.max_intercept_dist
+    intercepted_at = in_episode & close & (~successful & (interceptor >= 0))[:, None]
+    intercepted = intercepted_at.any(axis=1)
+    first_interception = np.where(intercepted, intercepted_at.argmax(axis=1), len(steps))
+    airborne = in_episode & (np.arange(len(steps)) < first_interception[:, None])
+
+    accepted = resolve_passes(passes, passes + airborne.sum(axis=1))
+    airborne &= accepted[:, None]
+    masked = np.concatenate([passes[accepted], flight[airborne]])
+    control_team[masked] = -1
+    control_index[masked] = -1
+    ball_x[flight[airborne]] = flight_x[airborne]
+    ball_z[flight[airborne]] = flight_z[airborne]
+    in_air[flight[airborne]] = True
+    caught = accepted & intercepted
+    caught_states = passes[caught] + first_interception[caught] + 1
+    ball_x[caught_states] = pos_x[caught_states, interceptor[caught]]
+    ball_z[caught_states] = pos_z[caught_states, interceptor[caught]]
+
+    # velocity to the next state of the episode, 0 when the ball lands, the last state of an
+    # episode keeps the one before
+    vel_x = np.zeros(num_states)
+    vel_z = np.zeros(num_states)
+    lands = in_air[:-1] & ~in_air[1:]
+    vel_x[:-1] = np.where(lands, 0.0, ball_x[1:] - ball_x[:-1])
+    vel_z[:-1] = np.where(lands, 0.0, ball_z[1:] - ball_z[:-1])
+    last = episode_ends - 1
+    vel_x[last] = np.where(lengths > 1, vel_x[last - 1], 0.0)
+    vel_z[last] = np.where(lengths > 1, vel_z[last - 1], 0.0)
+
+    return {'ball_pos_x': ball_x, 'ball_pos_z': ball_z, 'ball_in_air': in_air,
+            'ball_vel_x': vel_x, 'ball_vel_z': vel_z,
+            GameState.CONTROL_TEAM: control_team, GameState.CONTROL_INDEX: control_index}
+
+
+def postprocess_history(history, rules=DATACOLLECTION_GAME_RULES, drop_unfinished=True):
+    """
+    Adds the ball to a ColumnarStateHistory. Returns the (fields, columns, ticks) of the result
+    for columnar_history.WriteColumns, and the (starts, ends) of its episodes. With
+    drop_unfinished, only the episodes that end with a goal are kept.
+    """
+    starts, ends, finished = split_episodes(history.columns[GameState.CURRENT_PHASE],
+                                            history.ticks,
+                                            history.columns[GameState.PREVIOUS_PHASE])
+    if drop_unfinished:
+        starts, ends = starts[finished], ends[finished]
+    lengths = ends - starts
+    keep = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    episode_ends = np.cumsum(lengths)
+    episode_starts = episode_ends - lengths
+
+    columns = {name: column[keep] for name, column in history.columns.items()}
+    columns.update(compute_ball(columns, episode_starts, episode_ends, rules))
+    fields = list(history.fields.values())
+    fields += [{'name': name, 'kind': kind} for name, kind in BALL_FIELDS
+               if name not in history.fields]
+    return (fields, columns, history.ticks[keep]), (episode_starts, episode_ends)
+
+
+def postprocess_file(path, out_path, rules=DATACOLLECTION_GAME_RULES, drop_unfinished=True):
+    """Writes the states of a columnar history file with their ball to out_path."""
+    result, (starts, _) = postprocess_history(ColumnarStateHistory(path, mmap=True), rules,
+                                              drop_unfinished)
+    WriteColumns(out_path, *result)
+    return len(result[2]), len(starts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sts2.data.postprocess',
+                                     description='Adds the ball to a columnar state history.')
+    parser.add_argument('path', help='columnar state history file')
+    parser.add_argument('out_path', help='output file')
+    parser.add_argument('--rules', default='DATACOLLECTION_GAME_RULES',
+                        help='name of the rules in sts2.game.rules, for the pass airtime and '
+                             'interception distance')
+    parser.add_argument('--keep-unfinished', action='store_true',
+                        help='keep the episodes that do not end with a goal')
+    args = parser.parse_args(argv)
+
+    rules = getattr(game_rules, args.rules, None)
+    if not isinstance(rules, game_rules.Rules):
+        parser.error('unknown rules %s' % args.rules)
+    start = time.time()
+    num_states, num_episodes = postprocess_file(args.path, args.out_path, rules,
+                                                not args.keep_unfinished)
+    print('%d states in %d episodes, %.1fs' % (num_states, num_episodes, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,17 @@
 # Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
 
+import copy
 import random
 import numpy as np
 
-from sts2.client_adapter import ClientAdapter
+from sts2.client_adapter import ClientAdapter, ObservationMode
 from sts2.game.game import Game
-from sts2.game.game_state import Action
+from sts2.game.game_state import Action, GameState
 from sts2.game.player import SimplePlayer, AdaptedSimplePlayer, EgoisticPlayer, AggressivePlayer, DefensivePlayer, ShyPlayer
 from sts2.game.pygame_interface import PygameInterface, INTERFACE_SETTINGS
 from sts2.game.rules import STANDARD_GAME_RULES
 from sts2.game.settings import TeamSide
+from sts2.game.simulation import HistoryMode
 
 
 class AgentPlayer(SimplePlayer):
@@ -20,7 +22,7 @@ class AgentPlayer(SimplePlayer):
         discrete_action, continuous_input = game.client_adapter.unpack_action(self)
         if discrete_action is None:
             discrete_action = Action.NONE
-        else:
+        elif isinstance(discrete_action, str):
             discrete_action = getattr(Action, discrete_action)
         self.SetAction(game, discrete_action)
         self.SetInput(game, continuous_input)
@@ -42,7 +44,16 @@ def get_game(timeout_ticks,
              num_home_ShyPlayer,
              num_away_ShyPlayer,
              verbosity=0,
-             save_states=False):
+             save_states=False,
+             state_cls=GameState,
+             history_mode=HistoryMode.COPY,
+             history_capacity=100000,
+             history_spill_dir=None,
+             history_chunk_size=1024,
+             rules=None,
+             termination=None,
+             max_goals=None,
+             turbo=False):
     # Prepare players
     i = 0
     home_players = []
@@ -92,12 +103,22 @@ def get_game(timeout_ticks,
         i += 1
         away_players.append(ShyPlayer('a_shy_' + str(i), TeamSide.AWAY))
 
-    # Rules
-    rules = STANDARD_GAME_RULES
+    # Rules, copied since the timeout and termination are set on them
+    rules = copy.copy(rules if rules is not None else STANDARD_GAME_RULES)
     rules.max_tick = int(timeout_ticks)
+    if termination is not None:
+        rules.termination = termination
+    if max_goals is not None:
+        rules.max_goals = max_goals
 
-    return Game(home_players + away_players, rules, verbosity=verbosity,
-                save_states=save_states, client_adapter_cls=ClientAdapter)
+    game = Game(home_players + away_players, rules, verbosity=verbosity,
+                save_states=save_states, client_adapter_cls=ClientAdapter, state_cls=state_cls,
+                history_mode=history_mode, history_capacity=history_capacity,
+                history_spill_dir=history_spill_dir, history_chunk_size=history_chunk_size,
+                turbo=turbo)
+    game.client_adapter.set_agents(
+        [player for player in game.players if isinstance(player, AgentPlayer)])
+    return game
 
 
 def get_pygame(game, save_states):
@@ -126,7 +147,19 @@ class STS2Environment(object):
             with_pygame=False,
             save_states=False,
             timeout_ticks=1e10,
-            verbosity=0):
+            verbosity=0,
+            state_cls=GameState,
+            history_mode=HistoryMode.COPY,
+            history_capacity=100000,
+            history_spill_dir=None,
+            history_chunk_size=1024,
+            rules=None,
+            termination=None,
+            max_goals=None,
+            auto_reset=False,
+            frame_skip=1,
+            turbo=False,
+            observation_mode=ObservationMode.DICT):
 
         self.game = get_game(
             timeout_ticks=timeout_ticks,
@@ -145,15 +178,50 @@ class STS2Environment(object):
             num_home_ShyPlayer=num_home_ShyPlayer,
             num_away_ShyPlayer=num_away_ShyPlayer,
             verbosity=verbosity,
-            save_states=save_states)
+            save_states=save_states,
+            state_cls=state_cls,
+            history_mode=history_mode,
+            history_capacity=history_capacity,
+            history_spill_dir=history_spill_dir,
+            history_chunk_size=history_chunk_size,
+            rules=rules,
+            termination=termination,
+            max_goals=max_goals,
+            turbo=turbo)
 
+        # the pygame interface draws from the state history, which turbo doesn't record
+        assert (not (turbo and with_pygame))
         self.pygame = get_pygame(self.game, save_states) if with_pygame else None
+        self.auto_reset = auto_reset
+        self.frame_skip = frame_skip
+
+        # order of the agents in action batches
+        self.agent_names = [agent.name for agent in self.game.client_adapter.agent_slots]
+
+        # with ObservationMode.FLAT, the observations are written into observation_buffer
+        self.observation_mode = observation_mode
+        self.observation_schema = None
+        self.observation_buffer = None
+        if observation_mode == ObservationMode.FLAT:
+            self.observation_schema = self.game.client_adapter.get_observation_schema()
+            self.observation_buffer = np.zeros(self.observation_schema.size, dtype=np.float32)
 
     def seed(self, seed):
         random.seed(seed)
         np.random.seed(seed)
 
-    def reset(self):
+    def reset(self, observation_buffer=None):
+        """
+        Restarts the game in place, see Game.Reset. With ObservationMode.FLAT, returns the
+        observation buffer and the ObservationSchema, which has the static values. step keeps
+        writing into the same buffer, the caller can provide it.
+        """
+        self.game.Reset()
+        if self.observation_mode == ObservationMode.FLAT:
+            if observation_buffer is not None:
+                self.observation_buffer = observation_buffer
+            observation = self.game.client_adapter.send_state(self.observation_buffer)
+            return observation, self.observation_schema
         observation = self.game.client_adapter.send_state()
         return observation, ''
 
@@ -168,13 +236,37 @@ class STS2Environment(object):
             self.game.update()
 
     def step(self, action):
-        reward = None
-        info = None
+        """
+        action is None, a dict of agent name -> {'action': name, 'input': [x, z]}, or an action
+        batch: a tuple of an int array of Action codes and a (num_agents, 2) float array of
+        inputs, both in agent_names order.
 
-        self.game.client_adapter.receive_action(action)
+        The action is repeated for frame_skip ticks, or until the game is over, and the
+        observation is built once at the end. reward is the sum of the per-player rewards of
+        those ticks and info['events'] has their GameEvents.
 
-        self.update()
+        With auto_reset, a finished game is reset in the same step: done is True, the observation
+        is the first one of the next game and info['terminal_observation'] the last one of the
+        finished game.
+        """
+        game = self.game
+        reward = [0.0] * len(game.players)
+        num_events = len(game.game_event_history.event_list)
 
-        observation = self.game.client_adapter.send_state()
-        done = observation.get('current_phase') == "GAME_OVER"
+        game.client_adapter.receive_action(action)
+
+        for _ in range(self.frame_skip):
+            self.update()
+            reward = [total + r for total, r in zip(reward, game.player_reward_list)]
+            if game.IsSimulationComplete():
+                break
+
+        info = {'events': game.game_event_history.event_list[num_events:]}
+        observation = game.client_adapter.send_state(self.observation_buffer)
+        done = game.IsSimulationComplete()
+        if done and self.auto_reset:
+            if self.observation_mode == ObservationMode.FLAT:
+                observation = observation.copy()
+            info['terminal_observation'] = observation
+            observation, _ = self.reset()
         return observation, reward, done, info
@@ -0,0 +1,219 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+"""
+Columnar state history files: an uncompressed .npz with one array per state field.
+
+    __schema__  JSON header (0-d str array):
+                {"format": "sts2-columnar-history", "version": 1, "num_states": N,
+                 "fields": [{"name": ..., "kind": ..., "categories": [...]}, ...]}
+    __tick__    int64 (N,) tick of every state, -1 if unknown
+    <field>     (N,) array of every field, in schema order:
+                  float     float64, NaN where the field is missing
+                  int       int64
+                  bool      bool
+                  category  int32 codes into the field's categories, -1 where missing. Actions
+                            and phases use Action.NAMES and GamePhase.NAMES, so their codes are
+                            the game's own; other categories (player names) are in order of
+                            first appearance.
+
+The file is written uncompressed, so the columns can be memory-mapped from it, see MapColumns.
+"""
+
+import json
+import struct
+import zipfile
+import numpy
+import pandas
+
+from sts2.game.game_state import Action, IsActionField, IsPhaseField
+from sts2.game.settings import GamePhase
+from sts2.game.simulation import GameHistoryEntry, StateHistory
+
+
+FORMAT = 'sts2-columnar-history'
+VERSION = 1
+SCHEMA_KEY = '__schema__'
+TICK_KEY = '__tick__'
+
+
+class FieldKind:
+    FLOAT = 'float'
+    INT = 'int'
+    BOOL = 'bool'
+    CATEGORY = 'category'
+
+
+def GetFixedCategories(field):
+    if IsActionField(field):
+        return Action.NAMES
+    if IsPhaseField(field):
+        return GamePhase.NAMES
+    return None
+
+
+def EncodeColumn(field, values):
+    """Returns the (schema entry, array) of a column of python values, None where missing."""
+    present = [value for value in values if value is not None]
+    categories = GetFixedCategories(field)
+    if categories is None and present and all(isinstance(value, str) for value in present):
+        categories = list(dict.fromkeys(present))
+    if categories is not None:
+        # fixed categories may come as codes or as names
+        codes = {name: code for code, name in enumerate(categories)}
+        array = numpy.array([-1 if value is None else
+                             codes[value] if isinstance(value, str) else int(value)
+                             for value in values], dtype=numpy.int32)
+        return {'name': field, 'kind': FieldKind.CATEGORY, 'categories': list(categories)}, array
+
+    if present and len(present) == len(values):
+        if all(isinstance(value, (bool, numpy.bool_)) for value in values):
+            return {'name': field, 'kind': FieldKind.BOOL}, numpy.array(values, dtype=bool)
+        if all(isinstance(value, (int, numpy.integer)) and not isinstance(value, bool)
+               for value in values):
+            return {'name': field, 'kind': FieldKind.INT}, numpy.array(values, dtype=numpy.int64)
+    array = numpy.array([numpy.nan if value is None else value for value in values],
+                        dtype=numpy.float64)
+    return {'name': field, 'kind': FieldKind.FLOAT}, array
+
+
+def WriteColumnarHistory(path, field_names, rows, ticks=None):
+    """
+    Writes the states to path. rows is a (num_states, num_fields) object array or list of rows in
+    field_names order, with actions and phases as codes or names and None for missing values.
+    """
+    rows = numpy.asarray(rows, dtype=object).reshape(len(rows), len(field_names))
+    num_states = len(rows)
+    if ticks is None:
+        ticks = [None] * num_states
+
+    fields = []
+    columns = {}
+    for column, field in enumerate(field_names):
+        entry, array = EncodeColumn(field, list(rows[:, column]))
+        fields.append(entry)
+        columns[field] = array
+    WriteColumns(path, fields, columns, [-1 if tick is None else tick for tick in ticks])
+
+
+def WriteColumns(path, fields, columns, ticks):
+    """
+    Writes already encoded columns: fields are the schema entries, columns maps their names to
+    arrays of the kind's dtype, ticks has -1 where unknown.
+    """
+    ticks = numpy.asarray(ticks, dtype=numpy.int64)
+    schema = {'format': FORMAT, 'version': VERSION, 'num_states': len(ticks),
+              'fields': list(fields)}
+    dtypes = {FieldKind.FLOAT: numpy.float64, FieldKind.INT: numpy.int64, FieldKind.BOOL: bool,
+              FieldKind.CATEGORY: numpy.int32}
+    arrays = {entry['name']: numpy.asarray(columns[entry['name']], dtype=dtypes[entry['kind']])
+              for entry in fields}
+    numpy.savez(path, **{SCHEMA_KEY: numpy.array(json.dumps(schema)), TICK_KEY: ticks}, **arrays)
+
+
+def WriteNamedStates(path, states):
+    """Writes a list of state dicts, like the ones of the JSON state history files."""
+    field_names = list(dict.fromkeys(field for state in states for field in state))
+    WriteColumnarHistory(path, field_names,
+                         [[state.get(field) for field in field_names] for state in states])
+
+
+def MapColumns(path):
+    """
+    Memory-maps the arrays of an uncompressed .npz file, read-only, without reading their data.
+    Returns {name: array}.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as fin:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('compressed member %s cannot be mapped: %s' % (info.filename, path))
+            # the data follows the local file header, whose name and extra field lengths can
+            # differ from the ones of the central directory
+            fin.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', fin.read(4))
+            fin.seek(info.header_offset + 30 + name_length + extra_length)
+            version = numpy.lib.format.read_magic(fin)
+            if version == (1, 0):
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(fin)
+            else:
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(fin)
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if numpy.prod(shape) == 0:
+                arrays[name] = numpy.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = numpy.memmap(path, dtype=dtype, mode='r', offset=fin.tell(),
+                                            shape=shape, order='F' if fortran_order else 'C')
+    return arrays
+
+
+class ColumnarStateHistory(StateHistory):
+    """
+    Read-only state history of a columnar file. The Series of an entry is only built when the
+    entry is read, with actions and phases as codes like the game's own state. The columns are
+    loaded once, or with mmap memory-mapped, so opening a file takes the same time and memory
+    whatever its number of states and only the pages of the entries read are loaded.
+    """
+
+    def __init__(self, path, mmap=False):
+        with numpy.load(path) as data:
+            schema = json.loads(str(data[SCHEMA_KEY]))
+            if schema.get('format') != FORMAT or schema.get('version') != VERSION:
+                raise ValueError('not a version %d columnar state history: %s' % (VERSION, path))
+            if mmap:
+                data = MapColumns(path)
+            self.columns = {entry['name']: data[entry['name']] for entry in schema['fields']}
+            self.ticks = data[TICK_KEY]
+        self.schema = schema
+        self.fields = {entry['name']: entry for entry in schema['fields']}
+        self.field_names = pandas.Index(list(self.fields))
+
+    def __len__(self):
+        return self.schema['num_states']
+
+    def GetColumn(self, field, named=False):
+        """The column of a field. Category codes are decoded to their names with named."""
+        column = self.columns[field]
+        entry = self.fields[field]
+        if entry['kind'] != FieldKind.CATEGORY:
+            return column
+        # actions and phases are codes like in the game state, other categories are always names
+        if GetFixedCategories(field) is not None and not named:
+            return column
+        # code -1 (missing) picks the trailing None
+        categories = numpy.array(entry['categories'] + [None], dtype=object)
+        return categories[column]
+
+    def GetValue(self, field, index, named):
+        entry = self.fields[field]
+        value = self.columns[field][index]
+        kind = entry['kind']
+        if kind == FieldKind.FLOAT:
+            return None if numpy.isnan(value) else float(value)
+        if kind == FieldKind.INT:
+            return int(value)
+        if kind == FieldKind.BOOL:
+            return bool(value)
+        if value < 0:
+            return None
+        if named or GetFixedCategories(field) is None:
+            return entry['categories'][value]
+        return int(value)
+
+    def GetState(self, index, named=False):
+        """State dict of an entry, missing values left out. Actions and phases are names with named."""
+        state = {}
+        for field in self.fields:
+            value = self.GetValue(field, index, named)
+            if value is not None:
+                state[field] = value
+        return state
+
+    def GetNamedStates(self):
+        """All the states as named state dicts, the contents of a JSON state history file."""
+        return [self.GetState(index, named=True) for index in range(len(self))]
+
+    def GetEntry(self, index):
+        tick = int(self.ticks[index])
+        return GameHistoryEntry(None if tick < 0 else tick,
+                                pandas.Series(self.GetState(index), dtype=object),
+                                None, None, None, None, None)
@@ -10,25 +10,44 @@ Once discovered we can apply them to the full title.
 """
 
 import os
+import copy
 import numpy
 import pandas as pd
 import random
 import datetime
 import json
 
-from sts2.game.simulation import Simulation, GameEvent, GameHistoryEntry
+from sts2.game.simulation import Simulation, GameEvent, GameEventHistory, GameHistoryEntry, \
+    HistoryMode, DeltaStateHistory, RingStateHistory
 from sts2.game.arena import Arena
+from sts2.game.columnar_history import ColumnarStateHistory, WriteColumnarHistory
 from sts2.game.control import Control
-from sts2.game.game_state import GameState, Action
+from sts2.game.game_state import GameState, Action, CodeNamedFields
+from sts2.game.history_stream import HistoryStreamReader, StreamStateHistory
 from sts2.game.physics import Physics
+from sts2.game.player import Player
 from sts2.game.rules import Rules, STANDARD_GAME_RULES
 from sts2.game.settings import GamePhase, STS2Event, Outputs, TeamSide
 
 
+class GameSnapshot:
+    """Dynamic state of a Game as saved by Game.SaveSnapshot."""
+
+    def __init__(self, tick, state_buffer, num_events, random_state, numpy_random_state):
+        self.tick = tick
+        self.state_buffer = state_buffer
+        self.num_events = num_events
+        self.random_state = random_state
+        self.numpy_random_state = numpy_random_state
+
+
 class Game(Simulation):
     GOAL_REWARD = 1.0
+    STREAM_FILE = 'STATEHISTORY_%06d.stream'
 
-    def __init__(self, players, rules=None, verbosity=0, save_states=False, client_adapter_cls=None):
+    def __init__(self, players, rules=None, verbosity=0, save_states=False, client_adapter_cls=None,
+                 state_cls=GameState, history_mode=HistoryMode.COPY, history_capacity=100000,
+                 history_spill_dir=None, history_chunk_size=1024, turbo=False):
         super(Game, self).__init__(players, verbosity)
         self.client_adapter = client_adapter_cls(self)
         self.save_states = save_states
@@ -40,22 +59,69 @@ class Game(Simulation):
         self.rules = rules
         self.arena = Arena(rules.arena_size)
         self.physics = Physics(self)
+        self.CompileLayoutConstraint()
 
-        self.state = GameState(self)
+        self.state = state_cls(self)
         self.control = Control(self)
         self.state.SetField(GameState.PREVIOUS_PHASE, GamePhase.PRE_GAME, init=True)
         self.state.SetField(GameState.CURRENT_PHASE, GamePhase.PRE_GAME, init=True)
 
+        # turbo skips the per-tick work that doesn't change the game: state history, policy
+        # vectors, state copies and the arena drawing
+        self.turbo = turbo
+        assert (not (turbo and save_states))
+        # off for clones, see Clone
+        self.record_history = True
+
+        self.history_mode = history_mode
+        if history_mode == HistoryMode.DELTA:
+            self.game_state_history = DeltaStateHistory(self.state.GetFieldNames())
+        elif history_mode == HistoryMode.RING:
+            self.game_state_history = RingStateHistory(self.state.GetFieldNames(),
+                                                       len(self.players), history_capacity,
+                                                       history_spill_dir)
+        elif history_mode == HistoryMode.STREAM:
+            self.game_state_history = StreamStateHistory(
+                self.state.GetFieldNames(),
+                os.path.join(history_spill_dir or '.', self.STREAM_FILE), history_chunk_size)
+        # the game's own history while a loaded one is shown, see ShowStateHistory
+        self.recorded_state_history = None
+
         # More of the MAS additions
         self.players_by_distance_to_controller_by_team = {}
         self.init_exp = 1.0
 
+    def Reset(self):
+        """
+        Restarts the game in place from PRE_GAME: tick, state, events and state history are
+        cleared, the players, rules, state buffers and history buffers are kept. No random numbers
+        are drawn, so reset and fresh games play the same after seeding.
+        """
+        super(Game, self).Reset()
+        self.state.Reset()
+        self.state.SetField(GameState.PREVIOUS_PHASE, GamePhase.PRE_GAME)
+        self.state.SetField(GameState.CURRENT_PHASE, GamePhase.PRE_GAME)
+        self.RestoreRecordedStateHistory()
+        if self.history_mode == HistoryMode.COPY:
+            self.game_state_history = []
+        else:
+            self.game_state_history.Clear()
+        self.players_by_distance_to_controller_by_team = {}
+
     def CustomTick(self):
         vb = max(0, self.verbosity - 1)
+        self.PreMotionUpdate(vb)
+        self.LocomotionUpdate(vb)
+        self.physics.Update(vb)
+        self.PostMotionUpdate(vb)
+
+    def PreMotionUpdate(self, vb):
+        # everything before the players move, see VectorSTS2Environment for running the motion of
+        # many games at once
 
         # from base class but we want it logged
-        self.state.series = self.state.series.copy()
-        self.state.series.tick = self.tick
+        if self.history_mode == HistoryMode.COPY and self.record_history and not self.turbo:
+            self.state.StartTick(self.tick)
 
         self.player_action_list = [None] * len(self.players)
         self.player_reward_list = [0.0] * len(self.players)
@@ -68,17 +134,32 @@ class Game(Simulation):
 
         self.PhaseUpdate(vb)
 
-        self.DrawArena(vb)
+        if not self.turbo:
+            self.DrawArena(vb)
 
         self.AIUpdate(vb)
-        self.LocomotionUpdate(vb)
-        self.physics.Update(vb)
+
+    def EndUpdate(self, record_game_state=True):
+        record_game_state = record_game_state and self.record_history and not self.turbo
+        if record_game_state:
+            self.RestoreRecordedStateHistory()
+        super(Game, self).EndUpdate(record_game_state)
+        if self.IsSimulationComplete():
+            # saved once the GAME_OVER tick is in the history, as in the sts2.collect shards
+            if self.save_states:
+                self.SaveStateHistory()
+            # the last, partial chunk of a streamed history goes to disk when the game ends
+            if self.history_mode == HistoryMode.STREAM:
+                self.game_state_history.Flush()
+
+    def PostMotionUpdate(self, vb):
         self.ActionUpdate(vb)
         self.RulesUpdate(vb)
 
         if vb:
             print('tick %3d %10s -> %10s' % (
-                self.tick, self.GetPreviousGamePhase(), self.GetGamePhase()))
+                self.tick, GamePhase.GetName(self.GetPreviousGamePhase()),
+                GamePhase.GetName(self.GetGamePhase())))
 
     def InitPlayerPositions(self):
         for player in self.players:
@@ -93,7 +174,7 @@ class Game(Simulation):
     def RandomlyGiveControl(self):
         # random player seemed to mostly pick the first player
         # now alternating teams and picking random player
-        team = int((self.state.series.home_score + self.state.series.away_score)) % 2
+        team = int((self.GetScore(TeamSide.HOME) + self.GetScore(TeamSide.AWAY))) % 2
         if len(self.team_players[team]) == 0:
             team = TeamSide.Opposite(team)
         target = random.choice(self.team_players[team])
@@ -105,7 +186,8 @@ class Game(Simulation):
 
     def SetGamePhase(self, new_phase, verbosity=0):
         old_phase = self.GetGamePhase()
-        if verbosity: print('%s -> %s' % (old_phase, new_phase))
+        if verbosity: print('%s -> %s' % (GamePhase.GetName(old_phase),
+                                          GamePhase.GetName(new_phase)))
         self.state.SetField(GameState.PREVIOUS_PHASE, old_phase)
         self.state.SetField(GameState.CURRENT_PHASE, new_phase)
 
@@ -145,14 +227,20 @@ class Game(Simulation):
                 # this just clears out the "previous_phase" properly
                 self.SetGamePhase(GamePhase.GAME_ON, verbosity)
         elif self.GetGamePhase() == GamePhase.STOPPAGE_GOAL:
-            self.SetGamePhase(GamePhase.START_PLAY, verbosity)
+            # the tick of the goal is recorded as STOPPAGE_GOAL, the game ends in the next one
+            if self.IsGoalLimitReached():
+                self.SetGamePhase(GamePhase.GAME_OVER, verbosity)
+                self.game_event_history.AddEvent(
+                    GameEvent(self.tick, STS2Event.GAME_END, '', ''))
+            else:
+                self.SetGamePhase(GamePhase.START_PLAY, verbosity)
             self.PhaseUpdate(verbosity)
         elif self.GetGamePhase() == GamePhase.STOPPAGE_TIMEUP:
             self.SetGamePhase(GamePhase.GAME_OVER, verbosity)
             self.PhaseUpdate(verbosity)
         elif self.GetGamePhase() == GamePhase.GAME_OVER:
-            if self.save_states:
-                self.SaveStateHistory()
+            # the history is saved at the end of the tick, see EndUpdate
+            pass
         else:
             raise TypeError('unknown game phase', self.GetGamePhase())
 
@@ -183,12 +271,12 @@ class Game(Simulation):
 
     def PlayerDecisionsToRLStates(self, player):
         action = player.GetAction(self)
-        action_index = Action.ACTION_LIST.index(action)
+        action_index = action  # actions are coded by their index into Action.ACTION_LIST
         policy_vector = numpy.zeros(Outputs.NUM)  # TODO
 
         if action in Action.PASSES:
             policy_vector[Outputs.PASS] = 1.0
-        elif action is Action.SHOOT:
+        elif action == Action.SHOOT:
             policy_vector[Outputs.SHOOT] = 1.0
         else:
             policy_vector[Outputs.SKATE] = 1.0
@@ -222,36 +310,56 @@ class Game(Simulation):
         self.sort_by_distance_to_controller()
         for i, player in zip(range(len(self.players)), self.players):
             player.Think(self, verbosity)
+            if self.turbo:
+                self.player_action_list[i] = player.GetAction(self)
+                continue
             self.player_action_list[i], self.player_policy_list[i], self.player_value_estimate_list[
                 i] = self.PlayerDecisionsToRLStates(player)
 
     def LocomotionUpdate(self, verbosity):
-        for player in self.players:
-            control_input = player.GetInput(self)
-            player.RunMotionModel(self, control_input, player.GetActionTime(self))
-            if self.rules.layout_constraint is Rules.LayoutConstraint.CROSSOVER_CONSTRAINT:
-                i = player.GetTeamIndex(self)
-                x1 = 0.2
-                x2 = 0.6
-                y1 = 0.0
-                y2 = 1.0
-
-                # mirror for 2nd player
-                if i % 2:
-                    x1, x2 = 1.0 - x1, 1.0 - x2
-
-                x, y = self.arena.GetNormalizedCoord(player.GetPosition(self))
-
-                if player.team_side == TeamSide.AWAY:
-                    x, y = 1.0 - x, 1.0 - y
-
-                x_prime = x1 + (x2 - x1) * y / (y2 - y1)
-
-                if player.team_side == TeamSide.AWAY:
-                    x_prime, y = 1.0 - x_prime, 1.0 - y
-
-                constrained_pos = self.arena.GetArenaCoordFromNormalized(numpy.array([x_prime, y]))
-                player.SetPosition(self, constrained_pos)
+        positions, velocities = Player.RunMotionModelBatch(self.rules,
+                                                           self.state.GetPlayerPositions(),
+                                                           self.state.GetPlayerVelocities(),
+                                                           self.state.GetPlayerInputs(),
+                                                           self.state.GetPlayerActionTimes())
+        self.state.SetPlayerPositions(positions)
+        self.state.SetPlayerVelocities(velocities)
+
+        if self.rules.layout_constraint is Rules.LayoutConstraint.CROSSOVER_CONSTRAINT:
+            self.state.SetPlayerPositions(self.ApplyCrossoverConstraint(positions))
+
+    def CompileLayoutConstraint(self):
+        # per-player lines x = x1 + (x2 - x1) * y of the crossover constraint, in normalized arena
+        # coordinates as seen from the home side, in game.players order
+        y1 = 0.0
+        y2 = 1.0
+        self.crossover_x1 = numpy.zeros(len(self.players))
+        self.crossover_slope = numpy.zeros(len(self.players))
+        self.crossover_away = numpy.array([player.team_side == TeamSide.AWAY for player in self.players],
+                                          dtype=bool)
+        for p, player in enumerate(self.players):
+            x1 = 0.2
+            x2 = 0.6
+
+            # mirror for 2nd player
+            if self.team_players[player.team_side].index(player) % 2:
+                x1, x2 = 1.0 - x1, 1.0 - x2
+
+            self.crossover_x1[p] = x1
+            self.crossover_slope[p] = (x2 - x1) / (y2 - y1)
+
+    def ApplyCrossoverConstraint(self, positions):
+        # project the (..., N, 2) positions onto each player's line, mirrored for the away team
+        away = self.crossover_away
+        y = (positions[..., 1] - self.arena.min_z) / (self.arena.max_z - self.arena.min_z)
+        y = numpy.where(away, 1.0 - y, y)
+
+        x_prime = self.crossover_x1 + self.crossover_slope * y
+
+        x_prime = numpy.where(away, 1.0 - x_prime, x_prime)
+        y = numpy.where(away, 1.0 - y, y)
+
+        return self.arena.GetArenaCoordFromNormalized(numpy.stack([x_prime, y], axis=-1))
 
     def GetCapableTeamPlayers(self, team):
         return [player for player in self.team_players[team] if player.GetActionTime(self) == 0]
@@ -266,80 +374,110 @@ class Game(Simulation):
         return shot_directness_chance * shot_distance_chance
 
     def PlayerShot(self, player, simulate, verbosity):
+        """
+        With simulate the shot is only evaluated: the chance of scoring is returned without drawing
+        any random numbers or changing the game
+        """
         if not simulate:
             assert (self.control.GetControl() is player)
 
         on_net_chance = self.ComputeOnNetChance(player)
-        on_net = random.random() < on_net_chance
+        defenders = self.GetCapableTeamPlayers(TeamSide.Opposite(self.control.GetControl().team_side))
+        cache_key = (player, None, tuple(defenders))
+
+        if simulate:
+            return self.physics.InterceptChance(player.GetPosition(self),
+                                                player.GetAttackingNetPos(self),
+                                                defenders, cache_key=cache_key) * on_net_chance
 
+        on_net = random.random() < on_net_chance
         interceptor, through_chance = self.physics.InterceptTest(player.GetPosition(self),
                                                                  player.GetAttackingNetPos(self),
-                                                                 self.GetCapableTeamPlayers(
-                                                                     TeamSide.Opposite(
-                                                                         self.control.GetControl().team_side)),
-                                                                 max(0, verbosity - 1))
+                                                                 defenders,
+                                                                 max(0, verbosity - 1),
+                                                                 cache_key=cache_key)
 
-        if not simulate:
-            self.game_event_history.AddEvent(
-                GameEvent(self.tick, STS2Event.SHOT, player.name, ''))
+        self.game_event_history.AddEvent(
+            GameEvent(self.tick, STS2Event.SHOT, player.name, ''))
 
-            player.ResponseTime(self, self.rules.shot_response_time)
+        player.ResponseTime(self, self.rules.shot_response_time)
 
-            if interceptor:
-                self.game_event_history.AddEvent(
-                    GameEvent(self.tick, STS2Event.SHOT_BLOCK, interceptor.name, player.name))
-                self.control.GiveControl(interceptor)
-                interceptor.ResponseTime(self, self.rules.receive_response_time)
+        if interceptor:
+            self.game_event_history.AddEvent(
+                GameEvent(self.tick, STS2Event.SHOT_BLOCK, interceptor.name, player.name))
+            self.control.GiveControl(interceptor)
+            interceptor.ResponseTime(self, self.rules.receive_response_time)
+        else:
+            if on_net:
+                self.AwardGoal(player)
+                self.control.Reset(self)
             else:
-                if on_net:
-                    self.AwardGoal(player)
-                    self.control.Reset(self)
-                else:
-                    self.game_event_history.AddEvent(
-                        GameEvent(self.tick, STS2Event.MISSED_SHOT, player.name, ''))
-
-                    # give possession to closest player
-                    attacking_net_pos = player.GetAttackingNetPos(self)
-                    min_dist = None
-                    rebound_player = None
-                    for player in self.players:
-                        # project player onto trajectory to find unconstrained intercept point
-                        dist = numpy.linalg.norm(player.GetPosition(self) - attacking_net_pos)
-                        if min_dist is None or dist < min_dist:
-                            min_dist = dist
-                            rebound_player = player
-
-                    self.control.GiveControl(rebound_player)
-                    rebound_player.ResponseTime(self, self.rules.receive_response_time)
+                self.game_event_history.AddEvent(
+                    GameEvent(self.tick, STS2Event.MISSED_SHOT, player.name, ''))
+
+                # give possession to closest player
+                attacking_net_pos = player.GetAttackingNetPos(self)
+                min_dist = None
+                rebound_player = None
+                for player in self.players:
+                    # project player onto trajectory to find unconstrained intercept point
+                    dist = numpy.linalg.norm(player.GetPosition(self) - attacking_net_pos)
+                    if min_dist is None or dist < min_dist:
+                        min_dist = dist
+                        rebound_player = player
+
+                self.control.GiveControl(rebound_player)
+                rebound_player.ResponseTime(self, self.rules.receive_response_time)
 
         return through_chance * on_net_chance
 
+    def PlayerShotChances(self, players):
+        """
+        The chances PlayerShot(player, True, 0) returns, for all the players with one
+        InterceptTestBatch; no random numbers are drawn.
+        """
+        defenders = self.GetCapableTeamPlayers(TeamSide.Opposite(self.control.GetControl().team_side))
+        _, through_chances = self.physics.InterceptTestBatch(
+            [player.GetPosition(self) for player in players],
+            [player.GetAttackingNetPos(self) for player in players], defenders, sample=False)
+        return through_chances * numpy.array([self.ComputeOnNetChance(player) for player in players])
+
     def PlayerPass(self, source_player, target_player, simulate, verbosity):
+        """
+        With simulate the pass is only evaluated: the chance of it not being intercepted is
+        returned without drawing any random numbers or changing the game
+        """
         assert (self.control.GetControl() is source_player)
+        defenders = self.GetCapableTeamPlayers(TeamSide.Opposite(self.control.GetControl().team_side))
+        cache_key = (source_player, target_player, tuple(defenders))
+
+        if simulate:
+            return self.physics.InterceptChance(source_player.GetPosition(self),
+                                                target_player.GetPosition(self),
+                                                defenders, cache_key=cache_key)
+
         interceptor, through_chance = self.physics.InterceptTest(source_player.GetPosition(self),
                                                                  target_player.GetPosition(self),
-                                                                 self.GetCapableTeamPlayers(
-                                                                     TeamSide.Opposite(
-                                                                         self.control.GetControl().team_side)),
-                                                                 max(0, verbosity - 1))
-        if not simulate:
-            self.game_event_history.AddEvent(
-                GameEvent(self.tick, STS2Event.PASS, source_player.name, target_player.name))
+                                                                 defenders,
+                                                                 max(0, verbosity - 1),
+                                                                 cache_key=cache_key)
+        self.game_event_history.AddEvent(
+            GameEvent(self.tick, STS2Event.PASS, source_player.name, target_player.name))
 
-            if interceptor:
-                self.game_event_history.AddEvent(
-                    GameEvent(self.tick, STS2Event.PASS_INTERCEPT, interceptor.name,
-                              source_player.name))
-                self.control.GiveControl(interceptor)
-                interceptor.ResponseTime(self, self.rules.receive_response_time)
-            else:
-                self.game_event_history.AddEvent(
-                    GameEvent(self.tick, STS2Event.PASS_COMPLETE, target_player.name,
-                              source_player.name))
-                self.control.GiveControl(target_player)
-                target_player.ResponseTime(self, self.rules.receive_response_time)
+        if interceptor:
+            self.game_event_history.AddEvent(
+                GameEvent(self.tick, STS2Event.PASS_INTERCEPT, interceptor.name,
+                          source_player.name))
+            self.control.GiveControl(interceptor)
+            interceptor.ResponseTime(self, self.rules.receive_response_time)
+        else:
+            self.game_event_history.AddEvent(
+                GameEvent(self.tick, STS2Event.PASS_COMPLETE, target_player.name,
+                          source_player.name))
+            self.control.GiveControl(target_player)
+            target_player.ResponseTime(self, self.rules.receive_response_time)
 
-            source_player.ResponseTime(self, self.rules.pass_response_time)
+        source_player.ResponseTime(self, self.rules.pass_response_time)
         return through_chance
 
     def CompleteCheck(self, control_player, checking_player):
@@ -366,7 +504,7 @@ class Game(Simulation):
     def ActionUpdate(self, verbosity):
         control_player = self.control.GetControl()
         if control_player:
-            if control_player.GetAction(self) is Action.SHOOT:
+            if control_player.GetAction(self) == Action.SHOOT:
                 self.PlayerShot(control_player, False, max(0, verbosity - 1))
             else:
                 teammates = self.team_players[control_player.team_side]
@@ -374,44 +512,136 @@ class Game(Simulation):
                                                     Action.PASSES):
                     if teammate is control_player:
                         continue
-                    if control_player.GetAction(self) is pass_action:
+                    if control_player.GetAction(self) == pass_action:
                         self.PlayerPass(control_player, teammate, False, max(0, verbosity - 1))
 
     def RulesUpdate(self, verbosity):
         pass
 
+    def IsGoalLimitReached(self):
+        termination = self.rules.termination
+        if termination == Rules.Termination.EVERY_GOAL:
+            return True
+        if termination == Rules.Termination.GOALS:
+            total = self.GetScore(TeamSide.HOME) + self.GetScore(TeamSide.AWAY)
+            return total >= self.rules.max_goals
+        return False
+
     def IsSimulationComplete(self):
         # should return true if simulation is complete
-        return False  # self.GetGamePhase() is GamePhase.GAME_OVER
+        return self.GetGamePhase() == GamePhase.GAME_OVER
 
     def ShowState(self):
         pass
 
+    def SaveSnapshot(self, include_rng=True):
+        """
+        Save the dynamic state of the game (state fields including control, tick, event history
+        length and optionally the RNG states) for lookahead search. Rules, arena and players are
+        not part of it. Search rollouts should use update(record_game_state=False) since the
+        state history is not rewound by RestoreSnapshot.
+        """
+        return GameSnapshot(self.tick, self.state.GetBuffer(),
+                            len(self.game_event_history.event_list),
+                            random.getstate() if include_rng else None,
+                            numpy.random.get_state() if include_rng else None)
+
+    def RestoreSnapshot(self, snapshot):
+        self.tick = snapshot.tick
+        self.state.SetBuffer(snapshot.state_buffer)
+        del self.game_event_history.event_list[snapshot.num_events:]
+        if snapshot.random_state is not None:
+            random.setstate(snapshot.random_state)
+        if snapshot.numpy_random_state is not None:
+            numpy.random.set_state(snapshot.numpy_random_state)
+
+    def Clone(self):
+        """
+        Copy of the game that can be advanced independently. The rules, arena and player objects
+        are shared. The clone doesn't record state history or save states, so long rollouts don't
+        grow its memory.
+        """
+        clone = copy.copy(self)
+        clone.state = self.state.Clone(clone)
+        clone.control = Control(clone)
+        clone.physics = Physics(clone)
+        clone.client_adapter = copy.copy(self.client_adapter)
+        clone.client_adapter.game = clone
+        clone.game_event_history = GameEventHistory()
+        clone.game_event_history.event_list = list(self.game_event_history.event_list)
+        clone.history_mode = HistoryMode.COPY
+        clone.game_state_history = []
+        clone.recorded_state_history = None
+        clone.record_history = False
+        clone.save_states = False
+        clone.players_by_distance_to_controller_by_team = {}
+        clone._WipePlayerActionsAndRewardsForThisTick()
+        return clone
+
     def GetHashableGameStateVector(self):
-        return self.state.series
+        if self.history_mode == HistoryMode.COPY:
+            return self.state.series
+        return self.state.GetRow()
 
     def SaveStateHistory(self):
         date = datetime.date.today().isoformat()
         os.makedirs(os.path.join('.', 'datasets', date), exist_ok=True)
-        save_state_path = os.path.join('.', 'datasets', date, 'STATEHISTORY.json')
-        state_history = [state.state.to_dict() for state in self.game_state_history]
+        self.WriteStateHistory(os.path.join('.', 'datasets', date, 'STATEHISTORY.npz'))
 
-        with open(save_state_path, 'w') as fout:
-            json.dump(state_history, fout)
+    def WriteStateHistory(self, path):
+        """Writes the state history as a columnar .npz file, see columnar_history."""
+        if len(self.game_state_history):
+            field_names = list(self.game_state_history[0].state.index)
+        else:
+            field_names = self.state.GetFieldNames()
+        rows = [entry.state.to_numpy(dtype=object) for entry in self.game_state_history]
+        ticks = [entry.tick for entry in self.game_state_history]
+        WriteColumnarHistory(path, field_names, rows, ticks)
+
+    def ReadStateHistory(self, path):
+        """
+        Shows the (read-only) state history of a columnar .npz file, see ShowStateHistory. The
+        file is memory-mapped, the states are only read when they are used, e.g. by a replay.
+        """
+        self.ShowStateHistory(ColumnarStateHistory(path, mmap=True))
 
     def LoadStateHistory(self, load_path):
+        # columnar files, history streams or the JSON lists of named states of older versions
+        if load_path.endswith('.npz'):
+            self.ReadStateHistory(load_path)
+            return
+        if load_path.endswith('.stream'):
+            self.ShowStateHistory(HistoryStreamReader(load_path))
+            return
+
         with open(load_path, 'r') as fin:
             state_history = json.load(fin)
 
+        history = []
         for history_entry in state_history:
             h = GameHistoryEntry(tick=None,
-                                 state=pd.Series(history_entry),
+                                 state=pd.Series(CodeNamedFields(history_entry)),
                                  player_identity_list=None,
                                  player_policy_list=None,
                                  player_action_list=None,
                                  player_value_estimate_list=None,
                                  player_reward_list=None)
-            self.game_state_history.append(h)
+            history.append(h)
+        self.ShowStateHistory(history)
+
+    def ShowStateHistory(self, history):
+        """
+        Makes a loaded, read-only history the game_state_history, e.g. for a replay. The game's
+        own history is put back by Reset, or when the next tick is recorded.
+        """
+        if self.recorded_state_history is None:
+            self.recorded_state_history = self.game_state_history
+        self.game_state_history = history
+
+    def RestoreRecordedStateHistory(self):
+        if self.recorded_state_history is not None:
+            self.game_state_history = self.recorded_state_history
+            self.recorded_state_history = None
 
     def DrawArena(self, vb):
         if not vb:
@@ -1,26 +1,38 @@
 # Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
 
 
+import copy
 import pandas
 import numpy
 
-from sts2.game.settings import TeamSide
+from sts2.game.settings import TeamSide, GamePhase
 
 
 class Action:
-    SHOOT = "SHOOT"
-    PASS_1 = "PASS_1"
-    PASS_2 = "PASS_2"
-    PASS_3 = "PASS_3"
-    PASS_4 = "PASS_4"
-    PASS_5 = "PASS_5"
+    # integer coded, the code is the index into ACTION_LIST; names are only used for
+    # observations, agent input and saved files
+    SHOOT = 0
+    PASS_1 = 1
+    PASS_2 = 2
+    PASS_3 = 3
+    PASS_4 = 4
+    PASS_5 = 5
     PASSES = [PASS_1, PASS_2, PASS_3, PASS_4, PASS_5]
-    BLOCK = "BLOCK"
-    STUNNED = "STUNNED"
-    NONE = "NONE"
+    BLOCK = 6
+    STUNNED = 7
+    NONE = 8
     ACTION_LIST = [SHOOT, PASS_1, PASS_2, PASS_3, PASS_4, PASS_5, BLOCK, STUNNED, NONE]
+    NAMES = ["SHOOT", "PASS_1", "PASS_2", "PASS_3", "PASS_4", "PASS_5", "BLOCK", "STUNNED", "NONE"]
     NUM = len(ACTION_LIST)
 
+    @staticmethod
+    def GetName(action):
+        return Action.NAMES[int(action)]
+
+    @staticmethod
+    def FromName(name):
+        return Action.NAMES.index(name)
+
 
 class GameState:
     TICK = "tick"
@@ -59,9 +71,15 @@ class GameState:
     CONTROL_TEAM = "control_team"
     CONTROL_INDEX = "control_index"
 
+    # changing any of these bumps the revision, see InterceptCache
+    POSITION_FIELDS = (PLAYER_POS_X, PLAYER_POS_Z)
+
     def __init__(self, game):
         self.game = game
         self.series = pandas.Series()
+        self.revision = 0
+        # GetFieldValues fields -> series positions, the fields don't move after Init
+        self.field_positions = {}
         self.Init()
 
     def Init(self):
@@ -97,13 +115,50 @@ class GameState:
             self.SetPlayerField(player, self.PLAYER_ACTION, Action.NONE, init=True)
             self.SetPlayerField(player, self.PLAYER_ACTION_TIME, 0, init=True)
 
+    def Reset(self):
+        # fresh copy since the history may hold the current series, then the initial values
+        self.series = self.series.copy()
+        self.Init()
+
+    def StartTick(self, tick):
+        # start writing to a fresh copy so that the history entry of the previous tick doesn't
+        # alias the live state
+        self.series = self.series.copy()
+        self.series.tick = tick
+
+    def GetFieldNames(self):
+        return list(self.series.index)
+
+    def GetRow(self):
+        # copy of all field values in GetFieldNames() order, used by the delta history
+        return self.series.to_numpy(dtype=object, copy=True)
+
     def GetSnapshot(self):  # MAS, generic OpenAI-like use
         return {field: self.series[field] for field in self.series.index}
 
+    def GetNamedSnapshot(self):
+        """Snapshot with actions and phases as names, for observations and saved files."""
+        return NameCodedFields(self.GetSnapshot())
+
     def SetFromSnapshot(self, json_data):  # MAS, used for MCTS load game state
-        """No asserts, assuming json_data matches the columns."""
-        for field, value in json_data:
+        """No asserts, assuming json_data matches the columns. Actions and phases may be names."""
+        for field, value in CodeNamedFields(dict(json_data)).items():
             self.series[field] = value
+        self.revision += 1
+
+    def GetBuffer(self):
+        # copy of the whole dynamic state, see Game.SaveSnapshot
+        return self.series.copy()
+
+    def SetBuffer(self, buffer):
+        self.series = buffer.copy()
+        self.revision += 1
+
+    def Clone(self, game):
+        clone = copy.copy(self)
+        clone.game = game
+        clone.series = self.series.copy()
+        return clone
 
     def GetField(self, field):
         return self.series[field]
@@ -111,6 +166,8 @@ class GameState:
     def SetField(self, field, value, init=False):
         assert (init or field in self.series)
         self.series[field] = value
+        if field.endswith(self.POSITION_FIELDS):
+            self.revision += 1
 
     def GetTeamFieldPrefix(self, teamside):
         return TeamSide.GetName(teamside)
@@ -139,6 +196,8 @@ class GameState:
         # ensure we are not adding incorrect fields through assignment
         assert (init or field_name in self.series)
 
+        if field in self.POSITION_FIELDS and (init or self.series[field_name] != value):
+            self.revision += 1
         self.series[field_name] = value
 
     def GetPlayerPosition(self, player):
@@ -150,6 +209,7 @@ class GameState:
         prefix = self.GetPlayerFieldPrefix(player)
         self.series[prefix + self.PLAYER_POS_X] = pos[0]
         self.series[prefix + self.PLAYER_POS_Z] = pos[1]
+        self.revision += 1
 
     def GetPlayerVelocity(self, player):
         prefix = self.GetPlayerFieldPrefix(player)
@@ -170,3 +230,336 @@ class GameState:
         prefix = self.GetPlayerFieldPrefix(player)
         self.series[prefix + self.PLAYER_INPUT_X] = pos[0]
         self.series[prefix + self.PLAYER_INPUT_Z] = pos[1]
+
+    # bulk accessors, (players, 2) arrays in game.players order
+
+    def GetPlayerPositions(self):
+        return numpy.array([self.GetPlayerPosition(player) for player in self.game.players])
+
+    def SetPlayerPositions(self, positions):
+        for player, pos in zip(self.game.players, positions):
+            self.SetPlayerPosition(player, pos)
+
+    def GetPlayerVelocities(self):
+        return numpy.array([self.GetPlayerVelocity(player) for player in self.game.players])
+
+    def SetPlayerVelocities(self, velocities):
+        for player, vel in zip(self.game.players, velocities):
+            self.SetPlayerVelocity(player, vel)
+
+    def GetPlayerInputs(self):
+        return numpy.array([self.GetPlayerInput(player) for player in self.game.players])
+
+    def GetPlayerActionTimes(self):
+        return numpy.array([self.GetPlayerField(player, self.PLAYER_ACTION_TIME)
+                            for player in self.game.players])
+
+    def GetFieldValues(self, fields, out):
+        """Writes the values of the numeric fields into out, fields must be a tuple."""
+        positions = self.field_positions.get(fields)
+        if positions is None:
+            positions = self.series.index.get_indexer(fields)
+            self.field_positions[fields] = positions
+        out[:] = self.series.array[positions]
+
+
+def IsActionField(field):
+    return field.endswith(GameState.PLAYER_ACTION)
+
+
+def IsPhaseField(field):
+    return field == GameState.CURRENT_PHASE or field == GameState.PREVIOUS_PHASE
+
+
+def NameCodedFields(snapshot):
+    """Replace the action and phase codes of a snapshot dict by their names, in place."""
+    for field, value in snapshot.items():
+        if IsActionField(field):
+            snapshot[field] = Action.GetName(value)
+        elif IsPhaseField(field):
+            snapshot[field] = GamePhase.GetName(value)
+    return snapshot
+
+
+def CodeNamedFields(snapshot):
+    """Inverse of NameCodedFields, codes are left as they are."""
+    for field, value in snapshot.items():
+        if isinstance(value, str):
+            if IsActionField(field):
+                snapshot[field] = Action.FromName(value)
+            elif IsPhaseField(field):
+                snapshot[field] = GamePhase.FromName(value)
+    return snapshot
+
+
+class ArrayGameState(GameState):
+    """
+    GameState backend that keeps the numeric fields, including the action and phase codes, in
+    one contiguous float64 array and the player names in a small object array.
+
+    The field -> column index is compiled once from the player lists, so the Get/Set accessors
+    are plain array reads and writes instead of string building and Series label lookups.
+    Snapshots have the same fields, order and value types as the Series backed GameState.
+    """
+
+    # per-player numeric fields, in column order of the player block
+    PLAYER_NUMERIC_FIELDS = [GameState.PLAYER_IS_HUMAN, GameState.PLAYER_POS_X,
+                             GameState.PLAYER_POS_Z, GameState.PLAYER_VEL_X,
+                             GameState.PLAYER_VEL_Z, GameState.PLAYER_INPUT_X,
+                             GameState.PLAYER_INPUT_Z, GameState.PLAYER_ACTION_TIME,
+                             GameState.PLAYER_ACTION]
+    PLAYER_LABEL_FIELDS = [GameState.PLAYER_NAME]
+    # same order as the Series backend creates them
+    PLAYER_FIELDS = [GameState.PLAYER_NAME, GameState.PLAYER_IS_HUMAN, GameState.PLAYER_POS_X,
+                     GameState.PLAYER_POS_Z, GameState.PLAYER_VEL_X, GameState.PLAYER_VEL_Z,
+                     GameState.PLAYER_INPUT_X, GameState.PLAYER_INPUT_Z, GameState.PLAYER_ACTION,
+                     GameState.PLAYER_ACTION_TIME]
+    TEAM_FIELDS = [GameState.TEAM_NET_X, GameState.TEAM_NET_Z, GameState.TEAM_ATTACK_Z,
+                   GameState.TEAM_SCORE, GameState.TEAM_PLAYERS]
+    # global fields before and after the team and player fields
+    GLOBAL_HEAD_FIELDS = [GameState.ARENA_MIN_X, GameState.ARENA_MAX_X, GameState.ARENA_MIN_Z,
+                          GameState.ARENA_MAX_Z, GameState.CONTROL_TEAM, GameState.CONTROL_INDEX]
+    GLOBAL_TAIL_FIELDS = [GameState.PREVIOUS_PHASE, GameState.CURRENT_PHASE]
+
+    # fields that hold ints in the Series backend, converted back on read
+    INT_FIELDS = {GameState.CONTROL_TEAM, GameState.CONTROL_INDEX, GameState.PLAYER_IS_HUMAN,
+                  GameState.PLAYER_ACTION_TIME, GameState.PLAYER_ACTION,
+                  GameState.PREVIOUS_PHASE, GameState.CURRENT_PHASE}
+
+    POS = slice(1, 3)
+    VEL = slice(3, 5)
+    INPUT = slice(5, 7)
+    ACTION_TIME = 7
+
+    # which of the arrays a column is in
+    VALUES = 0
+    LABELS = 1
+
+    def __init__(self, game):
+        self.game = game
+        self.revision = 0
+        self.field_positions = {}
+        self.CompileLayout()
+        self.BindArrays(numpy.zeros(self.num_values), numpy.empty(self.num_labels, dtype=object))
+        self.Init()
+
+    def CompileLayout(self):
+        players = self.game.players
+        num_players = len(players)
+        num_player_numeric = len(self.PLAYER_NUMERIC_FIELDS)
+        num_player_labels = len(self.PLAYER_LABEL_FIELDS)
+
+        global_fields = self.GLOBAL_HEAD_FIELDS + self.GLOBAL_TAIL_FIELDS
+        num_global_numeric = len(global_fields) + len(self.TEAM_FIELDS) * len(TeamSide.TEAMSIDES)
+
+        self.num_players = num_players
+        self.num_global_values = num_global_numeric
+        self.num_values = num_global_numeric + num_players * num_player_numeric
+        self.num_labels = num_players * num_player_labels
+
+        # field name -> (VALUES or LABELS, column, is_int), in the same order as the Series backend
+        self.columns = {}
+
+        def AddColumn(field, array, column, kind):
+            self.columns[field] = (array, column, kind in self.INT_FIELDS)
+
+        for field in self.GLOBAL_HEAD_FIELDS:
+            AddColumn(field, self.VALUES, global_fields.index(field), field)
+        column = len(global_fields)
+        for teamside in TeamSide.TEAMSIDES:
+            for field in self.TEAM_FIELDS:
+                AddColumn(self.GetTeamFieldName(teamside, field), self.VALUES, column, field)
+                column += 1
+
+        self.player_slots = {}
+        self.player_prefixes = {}
+        for slot, player in enumerate(players):
+            self.player_slots[player] = slot
+            prefix = GameState.GetPlayerFieldPrefix(self, player)
+            self.player_prefixes[player] = prefix
+            for field in self.PLAYER_FIELDS:
+                if field in self.PLAYER_NUMERIC_FIELDS:
+                    column = num_global_numeric + slot * num_player_numeric + \
+                             self.PLAYER_NUMERIC_FIELDS.index(field)
+                    AddColumn(prefix + field, self.VALUES, column, field)
+                else:
+                    column = slot * num_player_labels + self.PLAYER_LABEL_FIELDS.index(field)
+                    AddColumn(prefix + field, self.LABELS, column, field)
+
+        for field in self.GLOBAL_TAIL_FIELDS:
+            AddColumn(field, self.VALUES, global_fields.index(field), field)
+        self.field_index = pandas.Index(list(self.columns))
+
+        # GetRow() positions of the values and labels, and of the values read back as ints
+        self.row_value_positions = numpy.zeros(self.num_values, dtype=int)
+        self.row_label_positions = numpy.zeros(self.num_labels, dtype=int)
+        int_positions = []
+        for position, (array, column, is_int) in enumerate(self.columns.values()):
+            if array == self.VALUES:
+                self.row_value_positions[column] = position
+                if is_int:
+                    int_positions.append((position, column))
+            else:
+                self.row_label_positions[column] = position
+        self.row_int_positions = numpy.array([p for p, c in int_positions], dtype=int)
+        self.row_int_columns = numpy.array([c for p, c in int_positions], dtype=int)
+
+        # field names of the values and labels columns, for bulk loading of snapshots
+        self.value_fields = [None] * self.num_values
+        self.label_fields = [None] * self.num_labels
+        for field, (array, column, is_int) in self.columns.items():
+            if array == self.VALUES:
+                self.value_fields[column] = field
+            else:
+                self.label_fields[column] = field
+
+        # per-player field -> (VALUES or LABELS, column, is_int) on the (players, fields) blocks
+        self.player_columns = {}
+        for column, field in enumerate(self.PLAYER_NUMERIC_FIELDS):
+            self.player_columns[field] = (self.VALUES, column, field in self.INT_FIELDS)
+        for column, field in enumerate(self.PLAYER_LABEL_FIELDS):
+            self.player_columns[field] = (self.LABELS, column, False)
+
+    def BindArrays(self, values, labels):
+        # values and labels may be views into larger buffers, the layout doesn't change
+        self.values = values
+        self.labels = labels
+        # explicit widths, so games without players reshape too
+        self.player_values = values[self.num_global_values:].reshape(
+            self.num_players, len(self.PLAYER_NUMERIC_FIELDS))
+        self.player_labels = labels.reshape(self.num_players, len(self.PLAYER_LABEL_FIELDS))
+        self.arrays = (self.values, self.labels)
+        self.player_arrays = (self.player_values, self.player_labels)
+
+    def Reset(self):
+        # in place, the arrays may be bound to a larger buffer
+        self.Init()
+
+    def StartTick(self, tick):
+        # history entries get their own materialized series, nothing aliases the arrays
+        pass
+
+    def GetBuffer(self):
+        # player names are the only labels and never change, so the values are the whole state
+        return self.values.copy()
+
+    def SetBuffer(self, buffer):
+        self.values[:] = buffer
+        self.revision += 1
+
+    def Clone(self, game):
+        # the compiled layout is shared, only the arrays are copied
+        clone = copy.copy(self)
+        clone.game = game
+        clone.BindArrays(self.values.copy(), self.labels.copy())
+        return clone
+
+    @property
+    def series(self):
+        # materialized on demand for code that still wants a pandas.Series (COPY history, replay),
+        # from the row and the shared index rather than a dict of the fields
+        return pandas.Series(self.GetRow(), index=self.field_index, dtype=object)
+
+    def GetFieldNames(self):
+        return list(self.columns)
+
+    def GetRow(self):
+        row = numpy.empty(len(self.columns), dtype=object)
+        row[self.row_value_positions] = self.values
+        row[self.row_int_positions] = self.values[self.row_int_columns].astype(int)
+        row[self.row_label_positions] = self.labels
+        return row
+
+    def GetSnapshot(self):
+        snapshot = {}
+        arrays = self.arrays
+        for field, (array, column, is_int) in self.columns.items():
+            value = arrays[array][column]
+            snapshot[field] = int(value) if is_int else value
+        return snapshot
+
+    def SetFromSnapshot(self, json_data):
+        """No asserts, assuming json_data has all the fields. Actions and phases may be names."""
+        json_data = CodeNamedFields(dict(json_data))
+        self.values[:] = [json_data[field] for field in self.value_fields]
+        self.labels[:] = [json_data[field] for field in self.label_fields]
+        self.revision += 1
+
+    def GetField(self, field):
+        array, column, is_int = self.columns[field]
+        value = self.arrays[array][column]
+        return int(value) if is_int else value
+
+    def SetField(self, field, value, init=False):
+        # the layout is fixed, init only exists for compatibility with the Series backend
+        assert (field in self.columns)
+        array, column, is_int = self.columns[field]
+        self.arrays[array][column] = value
+        if field.endswith(self.POSITION_FIELDS):
+            self.revision += 1
+
+    def SetTeamField(self, teamside, field, value, init=False):
+        self.SetField(self.GetTeamFieldName(teamside, field), value, init)
+
+    def GetPlayerFieldPrefix(self, player):
+        return self.player_prefixes[player]
+
+    def GetPlayerField(self, player, field):
+        array, column, is_int = self.player_columns[field]
+        value = self.player_arrays[array][self.player_slots[player], column]
+        return int(value) if is_int else value
+
+    def SetPlayerField(self, player, field, value, init=False):
+        # ensure we are not adding incorrect fields through assignment
+        assert (field in self.player_columns)
+        array, column, is_int = self.player_columns[field]
+        slot = self.player_slots[player]
+        if field in self.POSITION_FIELDS and self.player_arrays[array][slot, column] != value:
+            self.revision += 1
+        self.player_arrays[array][slot, column] = value
+
+    def GetPlayerPosition(self, player):
+        return self.player_values[self.player_slots[player], self.POS].copy()
+
+    def SetPlayerPosition(self, player, pos):
+        self.player_values[self.player_slots[player], self.POS] = pos
+        self.revision += 1
+
+    def GetPlayerVelocity(self, player):
+        return self.player_values[self.player_slots[player], self.VEL].copy()
+
+    def SetPlayerVelocity(self, player, pos):
+        self.player_values[self.player_slots[player], self.VEL] = pos
+
+    def GetPlayerInput(self, player):
+        return self.player_values[self.player_slots[player], self.INPUT].copy()
+
+    def SetPlayerInput(self, player, pos):
+        self.player_values[self.player_slots[player], self.INPUT] = pos
+
+    def GetPlayerPositions(self):
+        return self.player_values[:, self.POS].copy()
+
+    def SetPlayerPositions(self, positions):
+        self.player_values[:, self.POS] = positions
+        self.revision += 1
+
+    def GetPlayerVelocities(self):
+        return self.player_values[:, self.VEL].copy()
+
+    def SetPlayerVelocities(self, velocities):
+        self.player_values[:, self.VEL] = velocities
+
+    def GetPlayerInputs(self):
+        return self.player_values[:, self.INPUT].copy()
+
+    def GetPlayerActionTimes(self):
+        return self.player_values[:, self.ACTION_TIME].astype(int)
+
+    def GetFieldValues(self, fields, out):
+        columns = self.field_positions.get(fields)
+        if columns is None:
+            columns = numpy.array([self.columns[field][1] for field in fields], dtype=int)
+            assert all(self.columns[field][0] == self.VALUES for field in fields)
+            self.field_positions[fields] = columns
+        out[:] = self.values[columns]
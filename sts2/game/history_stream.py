@@ -0,0 +1,399 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+"""
+State history streams: an append-only file the states are written to while the game runs, in
+chunks of a fixed number of ticks, from a background thread.
+
+All integers are little endian:
+
+    header  b'STS2STRM', uint32 version, uint32 n, n bytes of JSON:
+            {"format": "sts2-history-stream", "version": 2, "chunk_size": ...,
+             "fields": [name, ...]}
+    chunk   b'CHNK', uint32 num_rows, uint32 m, uint32 crc32 of the body, then the body:
+                int64    (num_rows,)             ticks, -1 if unknown
+                float64  (num_rows, num_fields)  values, row major, in header field order
+                m bytes of JSON                  {"kinds": [kind, ...],  (first chunk only)
+                                                  "categories": {field: [category, ...]}}
+                                                 with the categories first seen in this chunk
+    chunk   ...
+
+Field kinds are the ones of sts2.game.columnar_history, decided from the first row. int and bool
+fields are stored as floats, category fields (player names) as codes into their categories, which
+are the concatenation of the categories of all the chunks so far, or -1 where missing.
+
+The header is written when the file is opened and chunks with a single write each, both flushed,
+so after a crash the file is readable up to the last complete chunk; an incomplete or corrupt
+chunk ends the stream. A file without chunks, or without a complete header, is an empty stream.
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import weakref
+import zlib
+
+import numpy
+import pandas
+
+from sts2.game.columnar_history import FieldKind, WriteColumnarHistory
+from sts2.game.simulation import GameHistoryEntry, StateHistory
+
+
+FORMAT = 'sts2-history-stream'
+VERSION = 2
+MAGIC = b'STS2STRM'
+CHUNK_MAGIC = b'CHNK'
+HEADER = struct.Struct('<8sII')
+CHUNK_HEADER = struct.Struct('<4sIII')
+
+
+def GetFieldKind(value):
+    if isinstance(value, str):
+        return FieldKind.CATEGORY
+    if isinstance(value, (bool, numpy.bool_)):
+        return FieldKind.BOOL
+    if isinstance(value, (int, numpy.integer)):
+        return FieldKind.INT
+    return FieldKind.FLOAT
+
+
+class HistoryStreamWriter:
+    """
+    Writes (tick, state row) pairs to a history stream. Rows are collected in memory and every
+    chunk_size rows the chunk is handed to a writer thread, so Append never waits for the disk.
+    With fsync, every chunk is also synced to the device, not only flushed to the OS.
+    """
+
+    def __init__(self, path, field_names, chunk_size=1024, fsync=False):
+        self.path = path
+        self.field_names = list(field_names)
+        self.chunk_size = int(chunk_size)
+
+        self.kinds = None  # decided from the first row, written with the first chunk
+        self.categorical_columns = None
+        self.codes = {}  # column -> {value: code}
+        self.new_categories = {}  # column -> categories not written yet
+
+        self.num_rows = 0  # rows appended
+        self.count = 0  # rows in the current chunk
+        self.AllocateChunk()
+
+        # state shared with the thread: chunk_offsets is only appended to by the thread
+        self.chunk_offsets = []  # (file offset, first row, num_rows) of the written chunks
+        self.error = []
+        self.queue = queue.Queue()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.fout = open(path, 'wb', buffering=1 << 20)
+        self.thread = threading.Thread(target=WriteChunks,
+                                       args=(self.queue, self.fout, fsync, self.chunk_offsets,
+                                             self.error),
+                                       name='history-stream', daemon=True)
+        self.thread.start()
+        # pending chunks still reach the file at exit if Close is never called
+        self.finalizer = weakref.finalize(self, FinishWriting, self.queue, self.thread)
+
+        header = {'format': FORMAT, 'version': VERSION, 'chunk_size': self.chunk_size,
+                  'fields': self.field_names}
+        data = json.dumps(header).encode()
+        self.queue.put((HEADER.pack(MAGIC, VERSION, len(data)) + data, None))
+
+    def AllocateChunk(self):
+        # a fresh buffer per chunk, the previous one belongs to the thread now
+        self.ticks = numpy.empty(self.chunk_size, dtype=numpy.int64)
+        self.values = numpy.empty((self.chunk_size, len(self.field_names)))
+
+    def CompileColumns(self, row):
+        self.kinds = [GetFieldKind(value) for value in row]
+        self.categorical_columns = [c for c, kind in enumerate(self.kinds)
+                                    if kind == FieldKind.CATEGORY]
+        self.numeric_columns = numpy.array(
+            [c for c, kind in enumerate(self.kinds) if kind != FieldKind.CATEGORY], dtype=int)
+        self.codes = {column: {} for column in self.categorical_columns}
+
+    def Encode(self, column, value):
+        if value is None:
+            return -1
+        code = self.codes[column].get(value)
+        if code is None:
+            code = len(self.codes[column])
+            self.codes[column][value] = code
+            self.new_categories.setdefault(column, []).append(value)
+        return code
+
+    def CheckError(self):
+        if self.error:
+            raise IOError('history stream %s could not be written' % self.path) from self.error[0]
+
+    def Append(self, tick, row):
+        """row is a state row in field_names order, see GameState.GetRow."""
+        if self.kinds is None:
+            self.CompileColumns(row)
+        slot = self.count
+        self.ticks[slot] = -1 if tick is None else tick
+        self.values[slot, self.numeric_columns] = row[self.numeric_columns]
+        for column in self.categorical_columns:
+            self.values[slot, column] = self.Encode(column, row[column])
+        self.count += 1
+        self.num_rows += 1
+        if self.count == self.chunk_size:
+            self.EndChunk()
+
+    def EndChunk(self):
+        self.CheckError()
+        if not self.count:
+            return
+        first_row = self.num_rows - self.count
+        metadata = {'categories': {self.field_names[column]: values
+                                   for column, values in self.new_categories.items()}}
+        if not first_row:
+            metadata['kinds'] = self.kinds
+        self.queue.put(((self.ticks, self.values, self.count, metadata), first_row))
+        self.new_categories = {}
+        self.count = 0
+        self.AllocateChunk()
+
+    def Flush(self):
+        """Writes the rows of the current chunk as a shorter chunk, without waiting for the disk."""
+        self.EndChunk()
+
+    def Wait(self):
+        """Waits until the chunks handed to the thread so far are in the file."""
+        self.queue.join()
+        self.CheckError()
+
+    def Close(self):
+        self.EndChunk()
+        self.finalizer()
+        self.CheckError()
+
+
+def PackChunk(ticks, values, num_rows, metadata):
+    data = json.dumps(metadata).encode()
+    body = ticks[:num_rows].tobytes() + values[:num_rows].tobytes() + data
+    return CHUNK_HEADER.pack(CHUNK_MAGIC, num_rows, len(data), zlib.crc32(body)) + body
+
+
+def WriteChunks(chunk_queue, fout, fsync, chunk_offsets, error):
+    # writer thread: one write and flush per chunk, so a crash can only cut off the last chunk
+    while True:
+        item, first_row = chunk_queue.get()
+        try:
+            if item is None:
+                fout.close()
+                return
+            if error:
+                continue
+            offset = fout.tell()
+            if isinstance(item, tuple):
+                fout.write(PackChunk(*item))
+                chunk_offsets.append((offset, first_row, item[2]))
+            else:
+                fout.write(item)
+            fout.flush()
+            if fsync:
+                os.fsync(fout.fileno())
+        except Exception as exception:
+            error.append(exception)
+        finally:
+            chunk_queue.task_done()
+
+
+def FinishWriting(chunk_queue, thread):
+    chunk_queue.put((None, None))
+    thread.join()
+
+
+class HistoryStreamReader(StateHistory):
+    """
+    Read-only state history of a history stream, up to its last complete chunk, which works while
+    it is still being written or after the writer crashed. Chunks are read when their entries are.
+    A stream without chunks is empty, and so is one whose header was cut off, with no fields.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.chunk_size = None
+        self.field_names = pandas.Index([])
+        self.kinds = None  # from the first chunk
+        self.categories = {}
+        self.chunk_offsets = []
+        self.num_rows = 0
+        self.loaded_chunk = (None, None)
+        with open(path, 'rb') as fin:
+            data = fin.read(HEADER.size)
+            if len(data) < HEADER.size:
+                return
+            magic, version, size = HEADER.unpack(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('not a version %d history stream: %s' % (VERSION, path))
+            data = fin.read(size)
+            if len(data) < size:
+                return
+            header = json.loads(data)
+            self.chunk_size = header['chunk_size']
+            self.field_names = pandas.Index(header['fields'])
+
+            row_size = 8 + 8 * len(self.field_names)
+            while True:
+                offset = fin.tell()
+                chunk_header = fin.read(CHUNK_HEADER.size)
+                if len(chunk_header) < CHUNK_HEADER.size:
+                    break
+                magic, num_rows, size, crc = CHUNK_HEADER.unpack(chunk_header)
+                body = fin.read(num_rows * row_size + size)
+                if magic != CHUNK_MAGIC or len(body) < num_rows * row_size + size or \
+                        zlib.crc32(body) != crc:
+                    break
+                metadata = json.loads(body[num_rows * row_size:])
+                if self.kinds is None:
+                    self.kinds = metadata['kinds']
+                    self.categories = {name: [] for name, kind in zip(self.field_names, self.kinds)
+                                       if kind == FieldKind.CATEGORY}
+                for name, values in metadata['categories'].items():
+                    self.categories[name] += values
+                self.chunk_offsets.append((offset, self.num_rows, num_rows))
+                self.num_rows += num_rows
+
+    def __len__(self):
+        return self.num_rows
+
+    def ReadChunk(self, chunk):
+        """The (ticks, values) arrays of a chunk."""
+        offset, _, num_rows = self.chunk_offsets[chunk]
+        return ReadChunkArrays(self.path, offset, num_rows, len(self.field_names))
+
+    def GetEntry(self, index):
+        chunk = FindChunk(self.chunk_offsets, index)
+        if self.loaded_chunk[0] != chunk:
+            self.loaded_chunk = (chunk, self.ReadChunk(chunk))
+        ticks, values = self.loaded_chunk[1]
+        offset = index - self.chunk_offsets[chunk][1]
+        return MakeEntry(ticks[offset], self.DecodeRow(values[offset]), self.field_names)
+
+    def ReadAll(self):
+        """The (ticks, values) arrays of the whole stream."""
+        chunks = [self.ReadChunk(chunk) for chunk in range(len(self.chunk_offsets))]
+        if not chunks:
+            return (numpy.zeros(0, dtype=numpy.int64),
+                    numpy.zeros((0, len(self.field_names))))
+        return (numpy.concatenate([ticks for ticks, _ in chunks]),
+                numpy.concatenate([values for _, values in chunks]))
+
+    def DecodeRow(self, values):
+        return DecodeRow(values, self.field_names, self.kinds, self.categories)
+
+    def GetRows(self):
+        """The (ticks, rows) of the whole stream, rows as python values, None where missing."""
+        ticks, values = self.ReadAll()
+        return ([None if tick < 0 else int(tick) for tick in ticks],
+                [self.DecodeRow(row) for row in values])
+
+
+def ReadChunkArrays(path, offset, num_rows, num_fields):
+    with open(path, 'rb') as fin:
+        fin.seek(offset + CHUNK_HEADER.size)
+        ticks = numpy.fromfile(fin, dtype='<i8', count=num_rows)
+        values = numpy.fromfile(fin, dtype='<f8', count=num_rows * num_fields)
+    return ticks, values.reshape(num_rows, num_fields)
+
+
+def FindChunk(chunk_offsets, index):
+    return next(chunk for chunk, (_, first_row, num_rows) in enumerate(chunk_offsets)
+                if index < first_row + num_rows)
+
+
+def MakeEntry(tick, row, field_names):
+    tick = int(tick)
+    return GameHistoryEntry(None if tick < 0 else tick,
+                            pandas.Series(row, index=field_names, dtype=object),
+                            None, None, None, None, None)
+
+
+def DecodeRow(values, field_names, kinds, categories):
+    row = numpy.empty(len(values), dtype=object)
+    for column, (value, kind) in enumerate(zip(values, kinds)):
+        if kind == FieldKind.CATEGORY:
+            row[column] = None if value < 0 else categories[field_names[column]][int(value)]
+        elif kind == FieldKind.INT:
+            row[column] = int(value)
+        elif kind == FieldKind.BOOL:
+            row[column] = bool(value)
+        else:
+            row[column] = value
+    return row
+
+
+def ConvertHistoryStream(path, out_path):
+    """Writes the complete chunks of a history stream as a columnar .npz file."""
+    reader = HistoryStreamReader(path)
+    ticks, rows = reader.GetRows()
+    WriteColumnarHistory(out_path, reader.field_names, rows, ticks)
+
+
+class StreamStateHistory(StateHistory):
+    """
+    Game state history written to a history stream as the game runs, only the current chunk is
+    kept in memory. Only the ticks and states are kept, not the actions, rewards or policies.
+    Reading back the entries of written chunks waits for the writer thread and reads the file.
+
+    path is formatted with the episode number, e.g. 'STATEHISTORY_%06d.stream': Clear closes the
+    stream of the finished episode and the next one goes to a new file.
+    """
+
+    def __init__(self, field_names, path, chunk_size=1024, fsync=False):
+        self.field_names = pandas.Index(field_names)
+        self.path_pattern = path
+        self.chunk_size = chunk_size
+        self.fsync = fsync
+        self.episode = 0
+        self.writer = HistoryStreamWriter(path % self.episode, field_names, chunk_size, fsync)
+        self.loaded_chunk = (None, None)
+
+    @property
+    def path(self):
+        return self.writer.path
+
+    def append(self, entry):
+        self.writer.Append(entry.tick, entry.state)
+
+    def __len__(self):
+        return self.writer.num_rows
+
+    def Flush(self):
+        self.writer.Flush()
+
+    def Close(self):
+        self.writer.Close()
+
+    def Clear(self):
+        # an episode without states keeps its file
+        if self.writer.num_rows:
+            self.writer.Close()
+            self.episode += 1
+            self.writer = HistoryStreamWriter(self.path_pattern % self.episode,
+                                              list(self.field_names), self.chunk_size, self.fsync)
+        self.loaded_chunk = (None, None)
+
+    def GetEntry(self, index):
+        writer = self.writer
+        first = writer.num_rows - writer.count
+        if index >= first:
+            ticks, values, offset = writer.ticks, writer.values, index - first
+        else:
+            writer.Wait()
+            chunk = FindChunk(writer.chunk_offsets, index)
+            ticks, values = self.LoadChunk(chunk)
+            offset = index - writer.chunk_offsets[chunk][1]
+        categories = {self.field_names[column]: list(codes)
+                      for column, codes in writer.codes.items()}
+        row = DecodeRow(values[offset], self.field_names, writer.kinds, categories)
+        return MakeEntry(ticks[offset], row, self.field_names)
+
+    def LoadChunk(self, chunk):
+        if self.loaded_chunk[0] != chunk:
+            offset, _, num_rows = self.writer.chunk_offsets[chunk]
+            self.loaded_chunk = (chunk, ReadChunkArrays(self.writer.path, offset, num_rows,
+                                                        len(self.field_names)))
+        return self.loaded_chunk[1]
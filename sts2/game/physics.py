@@ -2,45 +2,203 @@
 
 import numpy
 
+from sts2.game.rules import Rules
+from sts2.game.spatial_hash import SpatialHash
+
+
+def RowDot(a, b):
+    # dot product over the last axis, rounded the same as numpy.dot on single vectors
+    return (a[..., None, :] @ b[..., :, None])[..., 0, 0]
+
+
+class InterceptCache:
+    """
+    Intercept geometry of the trajectories evaluated during the current tick, keyed by
+    (source player, target player or None for the net, tuple of defenders). Cleared when the
+    tick changes or when a position changes (GameState.revision).
+
+    Only evaluations of the same trajectory at the same positions share an entry. The AI thinks
+    before the players move and ActionUpdate runs after, so the real shot or pass doesn't reuse
+    the AI's evaluation, and format_state goes through InterceptTestBatch instead. The built-in
+    players evaluate every trajectory once per tick, so the hits come from players whose think
+    evaluates the same shot or pass more than once.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.tick = None
+        self.revision = None
+        self.entries = {}
+
+    def Get(self, key):
+        if key is None:
+            return None
+        if self.tick != self.game.tick or self.revision != self.game.state.revision:
+            self.entries.clear()
+            self.tick = self.game.tick
+            self.revision = self.game.state.revision
+        return self.entries.get(key)
+
+    def Put(self, key, value):
+        if key is not None:
+            self.entries[key] = value
+
 
 class Physics:
+    # below this many players the brute force pair test is faster than the spatial hash
+    SPATIAL_HASH_MIN_PLAYERS = 64
+
     def __init__(self, game):
         self.game = game
+        # cells as large as the repulsion distance, the largest pair query
+        self.spatial_hash = SpatialHash(game.rules.player_radius * 4)
+        self.intercept_cache = InterceptCache(game)
 
     def Update(self, verbosity):
         self.BoardCollisionUpdate(max(0, verbosity - 1))
         self.PlayerCollisionUpdate(max(0, verbosity - 1))
 
     def BoardCollisionUpdate(self, verbosity):
-        # rectify collisions against boards
+        # rectify collisions against boards, all players at once
         arena = self.game.arena
+        state = self.game.state
 
         radius = self.game.rules.player_radius
-        min_x = arena.min_x + radius
-        max_x = arena.max_x - radius
-        min_z = arena.min_z + radius
-        max_z = arena.max_z - radius
-        for player in self.game.players:
-            position = player.GetPosition(self.game)
-            velocity = player.GetVelocity(self.game)
-
-            if position[0] < min_x:
-                position[0] = min_x
-                velocity[0] = 0
-            if position[0] > max_x:
-                position[0] = max_x
-                velocity[0] = 0
-            if position[1] < min_z:
-                position[1] = min_z
-                velocity[1] = 0
-            if position[1] > max_z:
-                position[1] = max_z
-                velocity[1] = 0
-
-            player.SetPosition(self.game, position)
-            player.SetVelocity(self.game, velocity)
+        mins = arena.mins + radius
+        maxs = arena.maxs - radius
+
+        positions, velocities = Physics.CollideWithBoards(state.GetPlayerPositions(),
+                                                          state.GetPlayerVelocities(), mins, maxs)
+        state.SetPlayerPositions(positions)
+        state.SetPlayerVelocities(velocities)
+
+    @staticmethod
+    def CollideWithBoards(positions, velocities, mins, maxs):
+        # positions and velocities are (..., 2) arrays, returns the new positions and velocities
+        velocities = velocities.copy()
+
+        # stop the motion into the boards
+        velocities[(positions < mins) | (positions > maxs)] = 0
+
+        return numpy.clip(positions, mins, maxs), velocities
 
     def PlayerCollisionUpdate(self, verbosity):
+        """
+        Repulse players that are close to each other, separate overlapping players and complete
+        checks on the controlling player. Returns the (control player, checking player) pairs of
+        the checks that were completed.
+        """
+        if self.game.rules.collision_model == Rules.CollisionModel.SEQUENTIAL_PAIRS:
+            return self.SequentialPlayerCollisionUpdate(verbosity)
+
+        rules = self.game.rules
+        state = self.game.state
+        positions = state.GetPlayerPositions()
+        velocities = state.GetPlayerVelocities()
+
+        first, second, distances = self.FindClosePairs(positions, rules.player_radius * 4)
+        positions, velocities, first, second = Physics.ResolvePlayerCollisions(
+            rules, positions, velocities, first, second, distances)
+        if rules.enable_player_collisions and len(first):
+            state.SetPlayerPositions(positions)
+        state.SetPlayerVelocities(velocities)
+
+        players = self.game.players
+        return self.CompleteChecks([(players[i], players[j]) for i, j in
+                                    zip(*Physics.GetOrderedPairs(first, second))])
+
+    @staticmethod
+    def ResolvePlayerCollisions(rules, positions, velocities, first, second, distances):
+        """
+        Repulsion and overlap response for the (first, second) player pairs within the repulsion
+        distance, indices into the (N, 2) positions and velocities. Returns the new positions and
+        velocities and the (first, second) pairs that overlap.
+        """
+        positions = positions.copy()
+        velocities = velocities.copy()
+        deltas = positions[first] - positions[second]  # position delta between players
+
+        # Repulsion so that players don't 'stick' together, once per pair
+        apart = distances > 0.0
+        repulsion = deltas[apart] / distances[apart, None] * (0.1 / distances[apart, None] ** 3)
+        numpy.add.at(velocities, first[apart], repulsion)
+        numpy.add.at(velocities, second[apart], -repulsion)
+
+        overlap = distances <= rules.player_radius * 2
+        first, second = first[overlap], second[overlap]
+        if rules.enable_player_collisions and len(first):
+            deltas, distances = deltas[overlap], distances[overlap]
+            centers = (positions[first] + positions[second]) * 0.5
+            avg_vels = (velocities[first] + velocities[second]) * 0.5
+
+            directions = numpy.tile([1.0, 0.0], (len(first), 1))
+            separate = distances > 0.002  # same as the 0.001 from the center per player
+            directions[separate] = deltas[separate] / distances[separate, None]
+            offsets = directions * rules.player_radius * 1.01
+
+            # players overlapping with several others get the mean of their resolved positions
+            position_sums = numpy.zeros_like(positions)
+            velocity_sums = numpy.zeros_like(velocities)
+            counts = numpy.zeros(len(positions))
+            numpy.add.at(position_sums, first, centers + offsets)
+            numpy.add.at(position_sums, second, centers - offsets)
+            numpy.add.at(velocity_sums, first, avg_vels)
+            numpy.add.at(velocity_sums, second, avg_vels)
+            numpy.add.at(counts, first, 1)
+            numpy.add.at(counts, second, 1)
+
+            colliding = counts > 0
+            positions[colliding] = position_sums[colliding] / counts[colliding, None]
+            velocities[colliding] = velocity_sums[colliding] / counts[colliding, None]
+
+        return positions, velocities, first, second
+
+    @staticmethod
+    def GetOrderedPairs(first, second):
+        # the pairs in both orders, in the same order as the sequential loop visits them
+        ordered_first = numpy.concatenate([first, second])
+        ordered_second = numpy.concatenate([second, first])
+        order = numpy.lexsort((ordered_second, ordered_first))
+        return ordered_first[order], ordered_second[order]
+
+    def FindClosePairs(self, positions, max_dist):
+        # (first, second, distance) of the player pairs within max_dist, first < second
+        if self.UseSpatialHash(len(positions), max_dist):
+            self.spatial_hash.Update(positions)
+            first, second = self.spatial_hash.GetCandidatePairs()
+            distances = numpy.sqrt(((positions[first] - positions[second]) ** 2).sum(axis=-1))
+            close = distances <= max_dist
+            return first[close], second[close], distances[close]
+
+        deltas = positions[:, None, :] - positions[None, :, :]
+        distances = numpy.sqrt((deltas ** 2).sum(axis=-1))
+        first, second = numpy.nonzero(numpy.triu(distances <= max_dist, 1))
+        return first, second, distances[first, second]
+
+    def UseSpatialHash(self, num_players, max_dist):
+        if max_dist > self.spatial_hash.cell_size:
+            return False
+        broadphase = self.game.rules.broadphase
+        if broadphase == Rules.Broadphase.AUTO:
+            return num_players >= Physics.SPATIAL_HASH_MIN_PLAYERS
+        return broadphase == Rules.Broadphase.SPATIAL_HASH
+
+    def CompleteChecks(self, colliding_pairs):
+        checks = []
+        for player1, player2 in colliding_pairs:
+            control_player = self.game.control.GetControl()
+            if player1 is control_player and player1.team_side != player2.team_side and player2.GetActionTime(
+                    self.game) == 0:
+                self.game.CompleteCheck(player1, player2)
+                checks.append((player1, player2))
+            elif player2 is control_player and player2.team_side != player1.team_side and player1.GetActionTime(
+                    self.game) == 0:
+                self.game.CompleteCheck(player2, player1)
+                checks.append((player2, player1))
+        return checks
+
+    def SequentialPlayerCollisionUpdate(self, verbosity):
+        checks = []
         for player1 in self.game.players:
             for player2 in self.game.players:
                 if player1 is player2:
@@ -82,11 +240,84 @@ class Physics:
                     if player1 is control_player and player1.team_side != player2.team_side and player2.GetActionTime(
                             self.game) == 0:
                         self.game.CompleteCheck(player1, player2)
+                        checks.append((player1, player2))
                     elif player2 is control_player and player2.team_side != player1.team_side and player1.GetActionTime(
                             self.game) == 0:
                         self.game.CompleteCheck(player2, player1)
+                        checks.append((player2, player1))
+
+        return checks
 
-    def InterceptTest(self, source, target, players, verbosity):
+    @staticmethod
+    def ComputeInterceptProbabilities(rules, sources, targets, positions):
+        """
+        Interception geometry of the InterceptTest model for the (T, 2) sources and targets against
+        defender positions, (D, 2) for the same defenders on all trajectories or (T, D, 2).
+        Returns the (T, D) probabilities, closest distances and in front of the source masks and
+        the (T,) trajectory distances. Rounds the same as InterceptTest.
+        """
+        traj_delta = targets - sources
+        traj_distance = numpy.sqrt(RowDot(traj_delta, traj_delta)) + 1e-10
+        traj_dir = traj_delta / traj_distance[:, None]
+
+        # (T, D) projections of the defenders onto the trajectories
+        player_source_delta = positions - sources[:, None, :]
+        intercept_source_dist = RowDot(traj_dir[:, None, :], player_source_delta)
+        in_front = intercept_source_dist > 0.0
+        # intercept points past the target are moved to the target
+        past_target = intercept_source_dist > traj_distance[:, None]
+        intercept_source_dist[past_target] = numpy.broadcast_to(
+            traj_distance[:, None], past_target.shape)[past_target]
+        intercepts = sources[:, None, :] + traj_dir[:, None, :] * intercept_source_dist[:, :, None]
+        intercepts[past_target] = numpy.broadcast_to(targets[:, None, :], intercepts.shape)[past_target]
+
+        intercept_delta = positions - intercepts
+        player_intercept_dist = numpy.sqrt(RowDot(intercept_delta, intercept_delta))
+        closest_dist = numpy.maximum(0.0, player_intercept_dist -
+                                     rules.player_intercept_speed * intercept_source_dist)
+        probs = rules.max_intercept_chance - (rules.max_intercept_chance - rules.min_intercept_chance) \
+                * closest_dist / rules.max_intercept_dist
+        probs[(closest_dist > rules.max_intercept_dist) | ~in_front] = 0.0
+
+        return probs, closest_dist, in_front, traj_distance
+
+    def InterceptTestBatch(self, sources, targets, defenders, sample=True):
+        """
+        Same interception model as InterceptTest, for many trajectories at once. sources and
+        targets are (T, 2) arrays, every trajectory is tested against all the defenders.
+
+        Returns (interceptors, through_chances): the intercepting player or None per trajectory
+        and the (T,) chances that each trajectory is not intercepted. The interceptor is the
+        closest of the defenders that succeeded their random draw, which gives the same
+        outcome distribution as the sequential test, but not the same random number sequence.
+        With sample=False no random numbers are drawn and all interceptors are None.
+        """
+        rules = self.game.rules
+        sources = numpy.asarray(sources, dtype=numpy.float64).reshape(-1, 2)
+        targets = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 2)
+        num_trajectories = len(sources)
+        if not defenders:
+            return [None] * num_trajectories, numpy.ones(num_trajectories)
+        positions = numpy.array([player.GetPosition(self.game) for player in defenders])
+        probs, closest_dist, in_front, traj_distance = Physics.ComputeInterceptProbabilities(
+            rules, sources, targets, positions)
+
+        through_chances = numpy.ones(num_trajectories)
+        for defender in range(len(defenders)):
+            through_chances *= 1.0 - probs[:, defender]
+
+        interceptors = [None] * num_trajectories
+        if sample:
+            success = in_front & (numpy.random.random(probs.shape) < probs) & \
+                      (closest_dist < traj_distance[:, None] + 1.0)
+            success_dist = numpy.where(success, closest_dist, numpy.inf)
+            closest = numpy.argmin(success_dist, axis=1)
+            for trajectory in numpy.nonzero(success.any(axis=1))[0]:
+                interceptors[trajectory] = defenders[closest[trajectory]]
+
+        return interceptors, through_chances
+
+    def InterceptTest(self, source, target, players, verbosity, cache_key=None):
         # test each player in list for interception
         # if not intercepted the pass/shot would be successful
         # interception is a probability based on the ratio of the distance from the interceptor to
@@ -94,17 +325,65 @@ class Physics:
         # as a baseline the probability is simply the ratio, so if the interceptor distance is 0 (along the path)
         # the interception is 100% and if the interceptor is just as far away it is 0%
         # the interception priority goes to the closest player to the start
-        traj_delta = (target - source)
-        traj_distance = numpy.linalg.norm(traj_delta) + 1e-10
-        traj_dir = traj_delta / traj_distance
-
         if verbosity:
             print('intercept test tick %d %f,%f to %f,%f' % (
                 self.game.tick, source[0], source[1], target[0], target[1]))
 
-        through_chance = 1.0
+        traj_distance, candidates, through_chance = self.GetInterceptGeometry(
+            source, target, players, verbosity, cache_key)
+
         intercepting_player = None
         shortest_intercept = traj_distance + 1.0
+        for player, prob, closest_dist, player_intercept_dist, intercept_source_dist in candidates:
+            if closest_dist < shortest_intercept:
+                r = numpy.random.random()
+                # prob = 1.0 - self.game.rules.intercept_scale * player_intercept_dist / traj_distance
+                if r < prob:
+                    intercepting_player = player
+                    shortest_intercept = closest_dist
+                    if verbosity: print(
+                        'player %s random %f < probability %f so intercepted' % (
+                            player.name, r, prob), 'closest_dist', closest_dist,
+                        'player_intercept_dist', player_intercept_dist, 'intercept_source_dist',
+                        intercept_source_dist)
+                else:
+                    if verbosity: print(
+                        'player %s random %f > probability %f so not intercepted' % (
+                            player.name, r, prob), 'closest_dist', closest_dist,
+                        'player_intercept_dist', player_intercept_dist, 'intercept_source_dist',
+                        intercept_source_dist)
+            else:
+                if verbosity: print(
+                    'player %s player_intercept_dist %f >= shortest_intercept %f so skipping' % (
+                        player.name, player_intercept_dist, shortest_intercept))
+
+        return intercepting_player, through_chance
+
+    def InterceptChance(self, source, target, players, cache_key=None):
+        # chance that the trajectory is not intercepted, without drawing any random numbers
+        return self.GetInterceptGeometry(source, target, players, 0, cache_key)[2]
+
+    def GetInterceptGeometry(self, source, target, players, verbosity, cache_key=None):
+        # the geometry only depends on the positions and the defenders, the random draws of
+        # InterceptTest are made on every call
+        geometry = self.intercept_cache.Get(cache_key)
+        if geometry is None:
+            geometry = self.ComputeInterceptGeometry(source, target, players, verbosity)
+            self.intercept_cache.Put(cache_key, geometry)
+        return geometry
+
+    def ComputeInterceptGeometry(self, source, target, players, verbosity):
+        """
+        Returns (traj_distance, candidates, through_chance) where candidates are the
+        (player, prob, closest_dist, player_intercept_dist, intercept_source_dist) of the players
+        in front of the source, in the order of players
+        """
+        traj_delta = (target - source)
+        traj_distance = numpy.linalg.norm(traj_delta) + 1e-10
+        traj_dir = traj_delta / traj_distance
+
+        through_chance = 1.0
+        candidates = []
         for player in players:
             # project player onto trajectory to find unconstrained intercept point
             player_source_delta = player.GetPosition(self.game) - source
@@ -133,30 +412,10 @@ class Physics:
                            * closest_dist / self.game.rules.max_intercept_dist
 
                 through_chance *= 1.0 - prob
-
-                if closest_dist < shortest_intercept:
-                    r = numpy.random.random()
-                    # prob = 1.0 - self.game.rules.intercept_scale * player_intercept_dist / traj_distance
-                    if r < prob:
-                        intercepting_player = player
-                        shortest_intercept = closest_dist
-                        if verbosity: print(
-                            'player %s random %f < probability %f so intercepted' % (
-                                player.name, r, prob), 'closest_dist', closest_dist,
-                            'player_intercept_dist', player_intercept_dist, 'intercept_source_dist',
-                            intercept_source_dist)
-                    else:
-                        if verbosity: print(
-                            'player %s random %f > probability %f so not intercepted' % (
-                                player.name, r, prob), 'closest_dist', closest_dist,
-                            'player_intercept_dist', player_intercept_dist, 'intercept_source_dist',
-                            intercept_source_dist)
-                else:
-                    if verbosity: print(
-                        'player %s player_intercept_dist %f >= shortest_intercept %f so skipping' % (
-                            player.name, player_intercept_dist, shortest_intercept))
+                candidates.append(
+                    (player, prob, closest_dist, player_intercept_dist, intercept_source_dist))
             else:
                 if verbosity: print('player %s intercept_source_dist %f is behind' % (
                     player.name, intercept_source_dist))
 
-        return intercepting_player, through_chance
+        return traj_distance, candidates, through_chance
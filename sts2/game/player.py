@@ -4,6 +4,7 @@ import sys
 import numpy
 
 from sts2.game.game_state import GameState, Action
+from sts2.game.physics import RowDot
 from sts2.game.rules import Rules
 from sts2.game.settings import TeamSide
 
@@ -131,6 +132,35 @@ class Player(object):
         self.SetPosition(game, position)
         self.SetVelocity(game, velocity)
 
+    @staticmethod
+    def RunMotionModelBatch(rules, positions, velocities, inputs, action_times):
+        """
+        RunMotionModel for many players at once on (N, 2) position, velocity and input arrays
+        and (N,) action times. Returns the new positions and velocities, rounded the same as the
+        per-player version.
+        """
+        inputs = inputs.copy()
+        accel_mags = numpy.sqrt(RowDot(inputs, inputs))
+        over = accel_mags > 1.0  # rules.max_accel
+        inputs[over] = inputs[over] / accel_mags[over, None]
+
+        if rules.motion_model == Rules.MotionModel.ACCELERATION_MODEL:
+            norm_vels = velocities / rules.max_vel
+            inputs[action_times != 0] = 0.0
+            actual_accels = inputs * (numpy.sqrt(RowDot(inputs, inputs)) - RowDot(norm_vels, inputs))[
+                :, None] * rules.max_accel
+            velocities = velocities + actual_accels
+        elif rules.motion_model == Rules.MotionModel.PAC_MAN_MODEL:
+            velocities = inputs
+        else:
+            velocities = velocities.copy()
+
+        vel_mags = numpy.sqrt(RowDot(velocities, velocities))
+        over = vel_mags > rules.max_vel
+        velocities[over] = velocities[over] * rules.max_vel / vel_mags[over, None]
+
+        return positions + velocities, velocities
+
     def IHaveControl(self, game):
         return game.control.GetControl() is self
 
@@ -275,6 +275,8 @@ class PygameInterface:
         self.replay_frame = -1
         if replay:
             self.replay_frame = 0
+        # (frame, state) of the last replay frame, histories build the states when they are read
+        self.replay_state = (None, None)
 
         self.text_print = TextPrint(self.screen)
 
@@ -288,11 +290,16 @@ class PygameInterface:
             self.replay_frame = numpy.clip(self.replay_frame, 0,
                                            len(self.game.game_state_history) - 1)
 
-            return self.game.game_state_history[self.replay_frame].state
+            if self.replay_state[0] != self.replay_frame:
+                self.replay_state = (self.replay_frame,
+                                     self.game.game_state_history[self.replay_frame].state)
+            return self.replay_state[1]
 
         # we are in live game
+        self.replay_state = (None, None)
         if self.game.IsSimulationComplete():
-            return None
+            # keep showing the end of the game until it is reset
+            return self.game.game_state_history[-1].state
 
         if self.AllowSimulation():
             self.game.update()
@@ -452,7 +459,8 @@ class PygameInterface:
         # 	self.text_print.Print("Tick %d/%d" % (self.game.tick, self.game.rules.max_tick)) # TODO: kernelize
 
         self.text_print.Print("H:%d A:%d" % (game_state.home_score, game_state.away_score))
-        self.text_print.Print("%s -> %s" % (game_state.previous_phase, game_state.current_phase))
+        self.text_print.Print("%s -> %s" % (GamePhase.GetName(game_state.previous_phase),
+                                            GamePhase.GetName(game_state.current_phase)))
         if self.pause_frames:
             self.text_print.Print("Pausing %d" % self.pause_frames)
 
@@ -565,7 +573,7 @@ class PygameInterface:
                 posx = game_state[team_prefix + str(player_index) + GameState.PLAYER_POS_X]
                 posz = game_state[team_prefix + str(player_index) + GameState.PLAYER_POS_Z]
 
-                if player_action is Action.SHOOT:
+                if player_action == Action.SHOOT:
                     colour = pygame.Color('black')
                     if game_state[GameState.CURRENT_PHASE] != GamePhase.STOPPAGE_GOAL:
                         colour = pygame.Color('red')
@@ -580,7 +588,7 @@ class PygameInterface:
                                      self.GameCoordToScreenCoord(net_posx, net_posz), width)
                 elif player_action in Action.PASSES:
                     for teammate_index, action in zip(range(team_players), Action.PASSES):
-                        if action is player_action:
+                        if action == player_action:
                             teammate_posx = game_state[
                                 team_prefix + str(teammate_index) + GameState.PLAYER_POS_X]
                             teammate_posz = game_state[
@@ -606,7 +614,7 @@ class PygameInterface:
         return self.pause_frames <= 0
 
     def SaveFrame(self):
-        return self.save_states and self.AllowSimulation() and self._frame.current_phase != 'GAME_OVER'
+        return self.save_states and self.AllowSimulation() and self._frame.current_phase != GamePhase.GAME_OVER
 
     def Quit(self):
         pygame.quit()
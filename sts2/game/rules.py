@@ -9,11 +9,33 @@ class Rules:
         NONE = "NONE"
         CROSSOVER_CONSTRAINT = "CROSSOVER_CONSTRAINT"
 
+    class CollisionModel:
+        # all pairs resolved at once from the positions at the start of the pass
+        VECTORIZED = "VECTORIZED"
+        # original loop over ordered pairs, every pair is visited (and repulsed) twice
+        SEQUENTIAL_PAIRS = "SEQUENTIAL_PAIRS"
+
+    class Broadphase:
+        # spatial hash from SPATIAL_HASH_MIN_PLAYERS players on, brute force below
+        AUTO = "AUTO"
+        BRUTE_FORCE = "BRUTE_FORCE"
+        SPATIAL_HASH = "SPATIAL_HASH"
+
+    class Termination:
+        # the game ends when max_tick is reached, always applies
+        TIME_UP = "TIME_UP"
+        # or once max_goals goals have been scored in total
+        GOALS = "GOALS"
+        # or with the first goal
+        EVERY_GOAL = "EVERY_GOAL"
+
     def __init__(self, max_tick, arena_size, player_radius, ball_radius, max_vel, max_accel,
                  min_intercept_chance, max_intercept_chance, max_intercept_dist,
                  player_intercept_speed, check_stun_time, shot_response_time, pass_response_time,
                  receive_response_time, shot_distance_accuracy_scale, enable_player_collisions,
-                 motion_model, layout_constraint, airtime):
+                 motion_model, layout_constraint, airtime,
+                 collision_model=CollisionModel.VECTORIZED, broadphase=Broadphase.AUTO,
+                 termination=Termination.TIME_UP, max_goals=1):
         self.max_tick = max_tick
         self.arena_size = arena_size
         self.player_radius = player_radius
@@ -33,6 +55,10 @@ class Rules:
         self.motion_model = motion_model
         self.layout_constraint = layout_constraint
         self.airtime = airtime
+        self.collision_model = collision_model
+        self.broadphase = broadphase
+        self.termination = termination
+        self.max_goals = max_goals
         assert self.airtime < self.receive_response_time - 1
 
 
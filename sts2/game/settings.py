@@ -16,12 +16,24 @@ class TeamSide:
 
 
 class GamePhase:
-    PRE_GAME = "PRE_GAME"
-    START_PLAY = "START_PLAY"
-    GAME_ON = "GAME_ON"
-    STOPPAGE_GOAL = "STOPPAGE_GOAL"
-    STOPPAGE_TIMEUP = "STOPPAGE_TIMEUP"
-    GAME_OVER = "GAME_OVER"
+    # integer coded so phases can live in the numeric state, names are only used for
+    # observations and saved files
+    PRE_GAME = 0
+    START_PLAY = 1
+    GAME_ON = 2
+    STOPPAGE_GOAL = 3
+    STOPPAGE_TIMEUP = 4
+    GAME_OVER = 5
+    NAMES = ["PRE_GAME", "START_PLAY", "GAME_ON", "STOPPAGE_GOAL", "STOPPAGE_TIMEUP", "GAME_OVER"]
+    NUM = len(NAMES)
+
+    @staticmethod
+    def GetName(phase):
+        return GamePhase.NAMES[int(phase)]
+
+    @staticmethod
+    def FromName(name):
+        return GamePhase.NAMES.index(name)
 
 
 class STS2Event:
@@ -1,8 +1,22 @@
 # Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
 
+import os
+import json
+import numpy
 import pandas
 
 
+class HistoryMode:
+    # every tick keeps its own full copy of the state
+    COPY = "COPY"
+    # only the fields that changed are kept, states are rebuilt when read
+    DELTA = "DELTA"
+    # preallocated numeric buffer of bounded size, see RingStateHistory
+    RING = "RING"
+    # written to a file in chunks while the game runs, see history_stream.StreamStateHistory
+    STREAM = "STREAM"
+
+
 class GameHistoryEntry:
     def __init__(self, tick, state, player_identity_list, player_policy_list, player_action_list,
                  player_value_estimate_list, player_reward_list):
@@ -20,6 +34,266 @@ class GameHistoryEntry:
               self.player_reward_list, 'value:', self.player_value_estimate_list)
 
 
+class StateHistory:
+    """
+    Base for the history stores that replace the plain list of GameHistoryEntry. Derived classes
+    implement append, __len__ and GetEntry, this adds the list-like indexing the replay and
+    Game.SaveStateHistory rely on.
+    """
+
+    def append(self, entry):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def GetEntry(self, index):
+        # index is already normalized to [0, len)
+        raise NotImplementedError
+
+    def Clear(self):
+        # drop all the entries but keep the buffers, for Game.Reset
+        raise NotImplementedError
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.GetEntry(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.GetEntry(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('history index out of range')
+        return self.GetEntry(index)
+
+
+class DeltaStateHistory(StateHistory):
+    """
+    List-like game state history that only stores the fields that changed in each tick.
+
+    Entries are appended with a state row (see GameState.GetRow) instead of a Series. A full row
+    is kept every keyframe_interval ticks and the Series of an entry is rebuilt when it is read,
+    starting from the closest keyframe, or from the last rebuilt entry when reading forward like
+    the replay does.
+    """
+
+    def __init__(self, field_names, keyframe_interval=256):
+        self.field_names = pandas.Index(field_names)
+        self.keyframe_interval = keyframe_interval
+        self.entries = []
+        self.changes = []  # (columns, values) per tick, columns is None for keyframes
+        self.last_row = None
+        self.cursor = None  # (index, row) of the last rebuilt entry
+
+    def append(self, entry):
+        row = entry.state
+        if len(self.changes) % self.keyframe_interval == 0:
+            self.changes.append((None, row))
+        else:
+            columns = numpy.flatnonzero(row != self.last_row)
+            self.changes.append((columns, row[columns]))
+        self.last_row = row
+        entry.state = None
+        self.entries.append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def Clear(self):
+        self.entries = []
+        self.changes = []
+        self.last_row = None
+        self.cursor = None
+
+    def GetEntry(self, index):
+        entry = self.entries[index]
+        state = pandas.Series(self.GetRow(index), index=self.field_names, dtype=object)
+        return GameHistoryEntry(entry.tick, state, entry.player_identity_list,
+                                entry.player_policy_list, entry.player_action_list,
+                                entry.player_value_estimate_list, entry.player_reward_list)
+
+    def GetRow(self, index):
+        keyframe = index - index % self.keyframe_interval
+        if self.cursor is not None and keyframe <= self.cursor[0] <= index:
+            start, row = self.cursor
+        else:
+            start, row = keyframe, self.changes[keyframe][1]
+
+        # rows handed out are never modified in place
+        row = row.copy()
+        for i in range(start + 1, index + 1):
+            columns, values = self.changes[i]
+            row[columns] = values
+
+        self.cursor = (index, row)
+        return row
+
+
+class RingStateHistory(StateHistory):
+    """
+    Game state history backed by a preallocated (capacity, num_fields) float64 buffer plus
+    per-player action, reward, value estimate and policy arrays, so memory stays bounded
+    however long the game runs.
+
+    Entries are appended with a state row (see GameState.GetRow). Categorical fields (names,
+    actions, phases) are stored as codes into per-column code books. When the buffer is full the
+    oldest entries are overwritten, or, if spill_dir is given, the whole buffer is written to
+    spill_dir as an .npz chunk and reused; spilled entries stay readable through indexing.
+    """
+
+    CHUNK_FILE = 'history_%06d.npz'
+
+    def __init__(self, field_names, num_players, capacity=100000, spill_dir=None):
+        self.field_names = pandas.Index(field_names)
+        self.num_players = num_players
+        self.capacity = int(capacity)
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        self.ticks = numpy.zeros(self.capacity, dtype=numpy.int64)
+        self.states = numpy.zeros((self.capacity, len(field_names)))
+        self.actions = numpy.full((self.capacity, num_players), -1, dtype=numpy.int64)
+        self.rewards = numpy.zeros((self.capacity, num_players))
+        self.value_estimates = numpy.zeros((self.capacity, num_players))
+        self.policies = None  # allocated once the policy size is known
+
+        self.categorical_columns = None  # decided from the first row
+        self.int_columns = None
+        self.codes = {}  # column -> {value: code}
+        self.categories = {}  # column -> [value, ...]
+        self.player_identity_list = None
+
+        self.count = 0  # entries in the buffer
+        self.total = 0  # entries ever appended
+        self.num_spilled = 0  # entries written to spill_dir
+        self.loaded_chunk = (None, None)
+
+    def CompileColumns(self, row):
+        self.categorical_columns = [c for c, value in enumerate(row) if isinstance(value, str)]
+        self.int_columns = numpy.array(
+            [c for c, value in enumerate(row) if isinstance(value, (int, numpy.integer))],
+            dtype=int)
+        self.numeric_columns = numpy.array(
+            [c for c in range(len(row)) if c not in self.categorical_columns], dtype=int)
+        for column in self.categorical_columns:
+            self.codes[column] = {}
+            self.categories[column] = []
+
+    def Encode(self, column, value):
+        code = self.codes[column].get(value)
+        if code is None:
+            code = len(self.categories[column])
+            self.codes[column][value] = code
+            self.categories[column].append(value)
+        return code
+
+    def append(self, entry):
+        row = entry.state
+        if self.categorical_columns is None:
+            self.CompileColumns(row)
+
+        if self.count == self.capacity:
+            if self.spill_dir is not None:
+                self.Spill()
+            else:
+                self.count -= 1  # evict the oldest entry
+
+        slot = self.total % self.capacity
+        self.ticks[slot] = entry.tick if entry.tick is not None else -1
+        self.states[slot, self.numeric_columns] = row[self.numeric_columns]
+        for column in self.categorical_columns:
+            self.states[slot, column] = self.Encode(column, row[column])
+
+        self.actions[slot] = [-1 if action is None else action
+                              for action in entry.player_action_list]
+        self.rewards[slot] = entry.player_reward_list
+        self.value_estimates[slot] = entry.player_value_estimate_list
+        self.StorePolicies(slot, entry.player_policy_list)
+        self.player_identity_list = entry.player_identity_list
+
+        self.count += 1
+        self.total += 1
+
+    def StorePolicies(self, slot, policy_list):
+        if self.policies is None:
+            sizes = [len(policy) for policy in policy_list if policy is not None]
+            if not sizes:
+                return
+            self.policies = numpy.full((self.capacity, self.num_players, sizes[0]), numpy.nan)
+        for i, policy in enumerate(policy_list):
+            self.policies[slot, i] = numpy.nan if policy is None else policy
+
+    def Spill(self):
+        # the buffer is full and oldest-first from slot 0 since total is a multiple of capacity
+        path = os.path.join(self.spill_dir, self.CHUNK_FILE % (self.num_spilled // self.capacity))
+        arrays = dict(ticks=self.ticks, states=self.states, actions=self.actions,
+                      rewards=self.rewards, value_estimates=self.value_estimates)
+        if self.policies is not None:
+            arrays['policies'] = self.policies
+        numpy.savez(path, field_names=numpy.array(self.field_names, dtype=str),
+                    categories=numpy.array(json.dumps(
+                        {str(c): v for c, v in self.categories.items()})), **arrays)
+        self.num_spilled += self.count
+        self.count = 0
+
+    def __len__(self):
+        return self.num_spilled + self.count
+
+    def Clear(self):
+        # the buffers and code books are reused, chunks already in spill_dir get overwritten
+        self.count = 0
+        self.total = 0
+        self.num_spilled = 0
+        self.loaded_chunk = (None, None)
+
+    def GetEntry(self, index):
+        if index < self.num_spilled:
+            chunk, offset = divmod(index, self.capacity)
+            arrays = self.LoadChunk(chunk)
+        else:
+            # index of the oldest retained entry in the buffer
+            first = self.total - self.count
+            offset = (first + index - self.num_spilled) % self.capacity
+            arrays = dict(ticks=self.ticks, states=self.states, actions=self.actions,
+                          rewards=self.rewards, value_estimates=self.value_estimates,
+                          policies=self.policies)
+        return self.DecodeEntry(arrays, offset)
+
+    def LoadChunk(self, chunk):
+        if self.loaded_chunk[0] != chunk:
+            path = os.path.join(self.spill_dir, self.CHUNK_FILE % chunk)
+            with numpy.load(path) as data:
+                arrays = {key: data[key] for key in data.files}
+            arrays.setdefault('policies', None)
+            self.loaded_chunk = (chunk, arrays)
+        return self.loaded_chunk[1]
+
+    def DecodeRow(self, values):
+        row = numpy.empty(len(values), dtype=object)
+        row[:] = values
+        row[self.int_columns] = values[self.int_columns].astype(int)
+        for column in self.categorical_columns:
+            row[column] = self.categories[column][int(values[column])]
+        return row
+
+    def DecodeEntry(self, arrays, offset):
+        tick = int(arrays['ticks'][offset])
+        state = pandas.Series(self.DecodeRow(arrays['states'][offset]), index=self.field_names,
+                              dtype=object)
+        actions = [None if action < 0 else int(action) for action in arrays['actions'][offset]]
+        policies = [None] * self.num_players
+        if arrays['policies'] is not None:
+            policies = [None if numpy.isnan(policy).all() else policy.copy()
+                        for policy in arrays['policies'][offset]]
+        return GameHistoryEntry(None if tick < 0 else tick, state, self.player_identity_list,
+                                policies, actions,
+                                list(arrays['value_estimates'][offset]),
+                                list(arrays['rewards'][offset]))
+
+
 class GameEvent:
     def __init__(self, tick, event_type, source_player_name, target_player_name):
         self.tick = tick
@@ -103,12 +377,24 @@ class Simulation:
         self._WipePlayerActionsAndRewardsForThisTick()
         self.game_event_history = GameEventHistory()
 
+    def Reset(self):
+        # back to the first tick, derived classes reset their own state
+        self.tick = 0
+        self._WipePlayerActionsAndRewardsForThisTick()
+        self.game_event_history = GameEventHistory()
+
     def update(self, record_game_state=True):
+        self.BeginUpdate()
+        self.CustomTick()
+        self.EndUpdate(record_game_state)
+
+    def BeginUpdate(self):
         if self.verbosity > 1:
             self.ShowState()
 
         self._WipePlayerActionsAndRewardsForThisTick()
-        self.CustomTick()
+
+    def EndUpdate(self, record_game_state=True):
         if record_game_state:
             self._AddGameStateHistoryForThisTick()
         self.tick += 1
@@ -0,0 +1,70 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import numpy
+
+
+class SpatialHash:
+    """
+    Uniform grid bucketing players by cell, used as a broadphase for pair queries.
+
+    Players are kept sorted by cell key. Each update only re-keys the players that changed cell,
+    and the previous order is re-sorted, which is cheap since it is nearly sorted already. Pair
+    queries look at the player's own cell and half of its neighbours, so every pair of cells is
+    visited once.
+    """
+    # cell keys are cell_x * KEY_STRIDE + cell_z
+    KEY_STRIDE = 1 << 20
+    NEIGHBOUR_OFFSETS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = None
+        self.keys = None
+        self.order = None
+        self.sorted_keys = None
+
+    def GetCellKeys(self, cells):
+        return cells[:, 0] * SpatialHash.KEY_STRIDE + cells[:, 1]
+
+    def Update(self, positions):
+        cells = numpy.floor(positions / self.cell_size).astype(numpy.int64)
+        if self.cells is None or len(cells) != len(self.cells):
+            self.keys = self.GetCellKeys(cells)
+            self.order = numpy.argsort(self.keys, kind='stable')
+        else:
+            moved = (cells != self.cells).any(axis=1)
+            if not moved.any():
+                return
+            self.keys[moved] = self.GetCellKeys(cells[moved])
+            self.order = self.order[numpy.argsort(self.keys[self.order], kind='stable')]
+        self.cells = cells
+        self.sorted_keys = self.keys[self.order]
+
+    def GetCandidatePairs(self):
+        """
+        Returns (first, second) index arrays of all the players in the same or adjacent cells,
+        with first < second, sorted by first then second
+        """
+        num_players = len(self.keys)
+        all_first = []
+        all_second = []
+        for offset_x, offset_z in SpatialHash.NEIGHBOUR_OFFSETS:
+            neighbour_keys = self.keys + offset_x * SpatialHash.KEY_STRIDE + offset_z
+            starts = numpy.searchsorted(self.sorted_keys, neighbour_keys, side='left')
+            counts = numpy.searchsorted(self.sorted_keys, neighbour_keys, side='right') - starts
+
+            # expand the [start, start + count) ranges of every player
+            total = counts.sum()
+            range_offsets = numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+            first = numpy.repeat(numpy.arange(num_players), counts)
+            second = self.order[numpy.arange(total) + range_offsets]
+            if offset_x == 0 and offset_z == 0:
+                keep = first < second
+                first, second = first[keep], second[keep]
+            all_first.append(numpy.minimum(first, second))
+            all_second.append(numpy.maximum(first, second))
+
+        first = numpy.concatenate(all_first)
+        second = numpy.concatenate(all_second)
+        order = numpy.lexsort((second, first))
+        return first[order], second[order]
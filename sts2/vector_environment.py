@@ -0,0 +1,502 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import multiprocessing
+import os
+import random
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+from sts2.client_adapter import ObservationMode
+from sts2.environment import get_game, STS2Environment
+from sts2.game.game_state import ArrayGameState, GameState
+from sts2.game.physics import Physics, RowDot
+from sts2.game.player import Player
+from sts2.game.rules import Rules
+from sts2.game.settings import GamePhase
+from sts2.game.simulation import HistoryMode
+
+
+def get_env_history_dir(history_mode, history_spill_dir, index):
+    """
+    The history_spill_dir of env index of a vector environment. The RING spill chunks and the
+    STREAM files have the same names in every game, so each env writes to its own env_<index>
+    subdirectory instead of overwriting the others.
+    """
+    if history_mode == HistoryMode.STREAM or \
+            (history_mode == HistoryMode.RING and history_spill_dir is not None):
+        return os.path.join(history_spill_dir or '.', 'env_%03d' % index)
+    return history_spill_dir
+
+
+class VectorSTS2Environment(object):
+    """
+    num_envs games with the same rules and rosters advanced in lockstep.
+
+    The dynamic state of all the games is kept in one (num_envs, num_values) array, the
+    ArrayGameState of each game is bound to a row of it. Phases, player AI and actions still run
+    per game; locomotion, board and player collisions and the scoring chances are computed for
+    all the games at once.
+
+    Observations are (num_envs, len(observation_fields)) arrays: the state values followed by the
+    scoring chance of every player. See step for the rewards, dones and infos.
+
+    The gym-like methods are snake_case like STS2Environment's; the stages that stand in for the
+    Game and Physics ones of every game (LocomotionUpdate, PhysicsUpdate, ...) keep their names.
+
+    The options are the ones of STS2Environment, except with_pygame. state_cls must be an
+    ArrayGameState, and observation_mode ObservationMode.FLAT (in the layout above, not the
+    ObservationSchema one), since the games share one array.
+    """
+
+    def __init__(
+            self,
+            num_envs,
+            *,
+            num_home_agents=0,
+            num_away_agents=0,
+            num_home_SimplePlayer=3,
+            num_away_SimplePlayer=3,
+            num_home_AdaptedSimplePlayer=0,
+            num_away_AdaptedSimplePlayer=0,
+            num_home_EgoisticPlayer=0,
+            num_away_EgoisticPlayer=0,
+            num_home_AggressivePlayer=0,
+            num_away_AggressivePlayer=0,
+            num_home_DefensivePlayer=0,
+            num_away_DefensivePlayer=0,
+            num_home_ShyPlayer=0,
+            num_away_ShyPlayer=0,
+            save_states=False,
+            timeout_ticks=1e10,
+            verbosity=0,
+            record_game_state=False,
+            history_mode=HistoryMode.COPY,
+            history_capacity=100000,
+            history_spill_dir=None,
+            history_chunk_size=1024,
+            rules=None,
+            termination=None,
+            max_goals=None,
+            state_cls=ArrayGameState,
+            auto_reset=False,
+            frame_skip=1,
+            turbo=False,
+            observation_mode=ObservationMode.FLAT):
+
+        # the game states are bound to rows of one array, and so are the observations
+        if not issubclass(state_cls, ArrayGameState):
+            raise ValueError('VectorSTS2Environment needs an ArrayGameState state_cls, not %s'
+                             % state_cls.__name__)
+        if observation_mode != ObservationMode.FLAT:
+            raise ValueError('VectorSTS2Environment only has ObservationMode.FLAT observations')
+
+        self.num_envs = num_envs
+        self.auto_reset = auto_reset
+        self.frame_skip = frame_skip
+        self.record_game_state = record_game_state
+        self.games = [get_game(
+            timeout_ticks=timeout_ticks,
+            num_home_agents=num_home_agents,
+            num_away_agents=num_away_agents,
+            num_home_SimplePlayer=num_home_SimplePlayer,
+            num_away_SimplePlayer=num_away_SimplePlayer,
+            num_home_AdaptedSimplePlayer=num_home_AdaptedSimplePlayer,
+            num_away_AdaptedSimplePlayer=num_away_AdaptedSimplePlayer,
+            num_home_EgoisticPlayer=num_home_EgoisticPlayer,
+            num_away_EgoisticPlayer=num_away_EgoisticPlayer,
+            num_home_AggressivePlayer=num_home_AggressivePlayer,
+            num_away_AggressivePlayer=num_away_AggressivePlayer,
+            num_home_DefensivePlayer=num_home_DefensivePlayer,
+            num_away_DefensivePlayer=num_away_DefensivePlayer,
+            num_home_ShyPlayer=num_home_ShyPlayer,
+            num_away_ShyPlayer=num_away_ShyPlayer,
+            verbosity=verbosity,
+            save_states=save_states,
+            state_cls=state_cls,
+            history_mode=history_mode,
+            history_capacity=history_capacity,
+            history_spill_dir=get_env_history_dir(history_mode, history_spill_dir, index),
+            history_chunk_size=history_chunk_size,
+            rules=rules,
+            termination=termination,
+            max_goals=max_goals,
+            turbo=turbo) for index in range(num_envs)]
+
+        # all the games share the layout of the first one
+        game = self.games[0]
+        layout = game.state
+        self.rules = game.rules
+        self.arena = game.arena
+        self.num_players = len(game.players)
+        self.player_names = [player.name for player in game.players]
+        self.agent_names = [agent.name for agent in game.client_adapter.agent_slots]
+        self.team_sides = np.array([player.team_side for player in game.players])
+        self.attacking_nets = np.array([player.GetAttackingNetPos(game) for player in game.players],
+                                       dtype=np.float64)
+
+        self.values = np.stack([game.state.values for game in self.games])
+        self.labels = np.stack([game.state.labels for game in self.games])
+        for row, game in enumerate(self.games):
+            assert (game.state.value_fields == layout.value_fields)
+            game.state.BindArrays(self.values[row], self.labels[row])
+        self.player_values = self.values[:, layout.num_global_values:].reshape(
+            num_envs, self.num_players, len(ArrayGameState.PLAYER_NUMERIC_FIELDS))
+
+        self.control_team_column = layout.columns[GameState.CONTROL_TEAM][1]
+        self.current_phase_column = layout.columns[GameState.CURRENT_PHASE][1]
+        self.observation_fields = list(layout.value_fields) + [
+            name + '_score_prob' for name in self.player_names]
+
+    def seed(self, seed):
+        random.seed(seed)
+        np.random.seed(seed)
+
+    def reset(self):
+        # the game states are reset in place, in their rows of values
+        for game in self.games:
+            game.Reset()
+        return self.get_observations(), ''
+
+    def step(self, actions):
+        """
+        actions is a sequence of num_envs actions as taken by STS2Environment.step, None, or an
+        action batch for all the games: a tuple of (num_envs, num_agents) action codes and
+        (num_envs, num_agents, 2) inputs.
+
+        Returns (observations, rewards, dones, infos): rewards is a (num_envs, num_players)
+        array, dones a (num_envs,) array, and infos has one dict per game as STS2Environment.step
+        returns it: the GameEvents of the step in 'events' and, with auto_reset, the last
+        observation of a finished game in 'terminal_observation', the returned one starting the
+        next game. As in STS2Environment.step, the action is repeated for frame_skip ticks,
+        stopping early when a game is over, and the rewards of those ticks are summed.
+        """
+        if actions is None:
+            actions = [None] * self.num_envs
+        elif isinstance(actions, tuple):
+            action_ids, action_inputs = actions
+            actions = [(action_ids[row], action_inputs[row]) for row in range(self.num_envs)]
+        num_events = [len(game.game_event_history.event_list) for game in self.games]
+        for game, action in zip(self.games, actions):
+            game.client_adapter.receive_action(action)
+
+        # the action is repeated for frame_skip ticks, or until a game is over
+        rewards = 0.0
+        for _ in range(self.frame_skip):
+            self.update()
+            rewards = rewards + self.get_rewards()
+            dones = self.get_dones()
+            if dones.any():
+                break
+
+        infos = [{'events': game.game_event_history.event_list[start:]}
+                 for game, start in zip(self.games, num_events)]
+        observations = self.get_observations()
+        if self.auto_reset and dones.any():
+            for row in np.flatnonzero(dones):
+                infos[row]['terminal_observation'] = observations[row].copy()
+                self.games[row].Reset()
+            observations = self.get_observations()
+        return observations, rewards, dones, infos
+
+    def update(self):
+        for game in self.games:
+            game.BeginUpdate()
+            game.PreMotionUpdate(max(0, game.verbosity - 1))
+
+        self.LocomotionUpdate()
+        self.PhysicsUpdate()
+
+        for game in self.games:
+            game.PostMotionUpdate(max(0, game.verbosity - 1))
+            game.EndUpdate(self.record_game_state)
+
+    def LocomotionUpdate(self):
+        # Game.LocomotionUpdate for all the games at once
+        player_values = self.player_values
+        positions, velocities = Player.RunMotionModelBatch(
+            self.rules,
+            player_values[:, :, ArrayGameState.POS].reshape(-1, 2),
+            player_values[:, :, ArrayGameState.VEL].reshape(-1, 2),
+            player_values[:, :, ArrayGameState.INPUT].reshape(-1, 2),
+            player_values[:, :, ArrayGameState.ACTION_TIME].reshape(-1))
+        positions = positions.reshape(self.num_envs, self.num_players, 2)
+
+        if self.rules.layout_constraint is Rules.LayoutConstraint.CROSSOVER_CONSTRAINT:
+            # the rosters are the same, so are the constraint lines
+            positions = self.games[0].ApplyCrossoverConstraint(positions)
+
+        player_values[:, :, ArrayGameState.POS] = positions
+        player_values[:, :, ArrayGameState.VEL] = velocities.reshape(positions.shape)
+        self.BumpRevisions()
+
+    def PhysicsUpdate(self):
+        # Physics.Update for all the games at once
+        rules = self.rules
+        player_values = self.player_values
+        radius = rules.player_radius
+
+        positions, velocities = Physics.CollideWithBoards(
+            player_values[:, :, ArrayGameState.POS], player_values[:, :, ArrayGameState.VEL],
+            self.arena.mins + radius, self.arena.maxs - radius)
+        player_values[:, :, ArrayGameState.POS] = positions
+        player_values[:, :, ArrayGameState.VEL] = velocities
+        self.BumpRevisions()
+
+        if rules.collision_model == Rules.CollisionModel.SEQUENTIAL_PAIRS or \
+                self.games[0].physics.UseSpatialHash(self.num_players, radius * 4):
+            for game in self.games:
+                game.physics.PlayerCollisionUpdate(max(0, game.verbosity - 2))
+            return
+
+        # pairs of all the games, with player indices offset by game so that they index the
+        # flattened (num_envs * num_players, 2) arrays
+        deltas = positions[:, :, None, :] - positions[:, None, :, :]
+        distances = np.sqrt((deltas ** 2).sum(axis=-1))
+        game_index, first, second = np.nonzero(np.triu(distances <= radius * 4, 1))
+        offsets = game_index * self.num_players
+        positions, velocities, first, second = Physics.ResolvePlayerCollisions(
+            rules, positions.reshape(-1, 2), velocities.reshape(-1, 2), first + offsets,
+            second + offsets, distances[game_index, first, second])
+        player_values[:, :, ArrayGameState.POS] = positions.reshape(self.num_envs, self.num_players, 2)
+        player_values[:, :, ArrayGameState.VEL] = velocities.reshape(self.num_envs, self.num_players, 2)
+        self.BumpRevisions()
+
+        # checks still go through each game
+        game_index = first // self.num_players
+        for g in np.unique(game_index):
+            game = self.games[g]
+            in_game = game_index == g
+            players = game.players
+            ordered_first, ordered_second = Physics.GetOrderedPairs(first[in_game] % self.num_players,
+                                                                    second[in_game] % self.num_players)
+            game.physics.CompleteChecks([(players[i], players[j]) for i, j in
+                                         zip(ordered_first, ordered_second)])
+
+    def BumpRevisions(self):
+        # the positions were written behind the back of the game states
+        for game in self.games:
+            game.state.revision += 1
+
+    def ComputeScoreChances(self):
+        """
+        Same as the format_state PlayerShot(player, True, 0) of every player of every game, as a
+        (num_envs, num_players) array
+        """
+        num_envs, num_players = self.num_envs, self.num_players
+        player_values = self.player_values
+        positions = player_values[:, :, ArrayGameState.POS]
+
+        # defenders are the capable players of the team without control
+        control_team = self.values[:, self.control_team_column]
+        capable = (self.team_sides[None, :] != control_team[:, None]) & \
+                  (player_values[:, :, ArrayGameState.ACTION_TIME] == 0)
+
+        # one trajectory per game and player, against all the players of that game
+        sources = positions.reshape(-1, 2)
+        targets = np.tile(self.attacking_nets, (num_envs, 1))
+        probs = Physics.ComputeInterceptProbabilities(self.rules, sources, targets,
+                                                      np.repeat(positions, num_players, axis=0))[0]
+        probs[~np.repeat(capable, num_players, axis=0)] = 0.0
+        through_chances = np.ones(len(sources))
+        for defender in range(num_players):
+            through_chances *= 1.0 - probs[:, defender]
+
+        # Game.ComputeOnNetChance
+        net_delta = targets - sources
+        net_dir = net_delta / np.sqrt(RowDot(net_delta, net_delta))[:, None]
+        shot_directness_chance = np.abs(net_dir[:, 1])
+        shot_distance_chance = np.minimum(1.0, self.rules.shot_distance_accuracy_scale / np.abs(
+            net_delta[:, 1]))
+
+        return (through_chances * (shot_directness_chance * shot_distance_chance)).reshape(
+            num_envs, num_players)
+
+    def get_observations(self):
+        return np.concatenate([self.values, self.ComputeScoreChances()], axis=1)
+
+    def get_rewards(self):
+        return np.array([game.player_reward_list for game in self.games])
+
+    def get_dones(self):
+        return self.values[:, self.current_phase_column] == GamePhase.GAME_OVER
+
+
+def env_worker(remote, env_kwargs):
+    """
+    Worker process of SubprocVectorSTS2Environment. Runs one STS2Environment and writes its
+    observations into its row of the shared observation buffer. Replies are ('ok', result), or
+    ('error', traceback) when the env raised, after which the worker exits.
+    """
+    shm = None
+    out = None
+    try:
+        env_kwargs = dict(env_kwargs, observation_mode=ObservationMode.FLAT, auto_reset=False)
+        env = STS2Environment(**env_kwargs)
+        remote.send(('ok', env.observation_schema))
+
+        shm_name, row, shape = remote.recv()
+        shm = shared_memory.SharedMemory(name=shm_name)
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)[row, :env.observation_schema.size]
+        env.reset(out)
+        remote.send(('ok', None))
+        while True:
+            command, data = remote.recv()
+            if command == 'step':
+                action, auto_reset = data
+                _, reward, done, info = env.step(action)
+                info['reward_list'] = reward
+                if done and auto_reset:
+                    info['terminal_observation'] = out.copy()
+                    env.reset()
+                remote.send(('ok', (done, info)))
+            elif command == 'reset':
+                env.reset()
+                remote.send(('ok', None))
+            elif command == 'seed':
+                env.seed(data)
+                remote.send(('ok', None))
+            elif command == 'close':
+                break
+    except (EOFError, KeyboardInterrupt):
+        # the parent is gone or interrupted, there is nobody to report to
+        pass
+    except Exception:
+        remote.send(('error', traceback.format_exc()))
+    finally:
+        del out
+        if shm is not None:
+            shm.close()
+        remote.close()
+
+
+def receive_all(remotes):
+    """
+    Returns the results of the env_worker replies of all the remotes. All the replies are read
+    before raising the error of a failed worker, so the others stay in sync.
+    """
+    replies = [remote.recv() for remote in remotes]
+    for status, result in replies:
+        if status == 'error':
+            raise RuntimeError('STS2Environment worker failed:\n' + result)
+    return [result for _, result in replies]
+
+
+class SubprocVectorSTS2Environment(object):
+    """
+    STS2Environments in worker processes, one per entry of env_kwargs (the STS2Environment
+    options of each env, so rosters and rules can differ).
+
+    The workers write their observations into one shared (num_envs, obs_dim) float32 buffer and
+    reset returns a view of it, without copies: the contents change with every step. Row i holds
+    env i's flat observation in observation_schemas[i] layout (see ObservationSchema), zero
+    padded to obs_dim. See step for the rewards, dones and infos. step_async/step_wait allow
+    doing other work while the envs step.
+    """
+
+    def __init__(self, env_kwargs, auto_reset=True, start_method=None):
+        self.num_envs = len(env_kwargs)
+        self.auto_reset = auto_reset
+        self.waiting = False
+        context = multiprocessing.get_context(start_method)
+        # the workers must share the parent's resource tracker, or each of them starts its own
+        # one that reports the shared observations as leaked
+        resource_tracker.ensure_running()
+
+        self.remotes = []
+        self.processes = []
+        for index, kwargs in enumerate(env_kwargs):
+            kwargs = dict(kwargs, history_spill_dir=get_env_history_dir(
+                kwargs.get('history_mode', HistoryMode.COPY), kwargs.get('history_spill_dir'), index))
+            remote, worker_remote = context.Pipe()
+            process = context.Process(target=env_worker, args=(worker_remote, kwargs), daemon=True)
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        self.shm = None
+        try:
+            self.observation_schemas = receive_all(self.remotes)
+            self.observation_fields = [schema.fields for schema in self.observation_schemas]
+            self.obs_dim = max(schema.size for schema in self.observation_schemas)
+            shape = (self.num_envs, self.obs_dim)
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=int(np.prod(shape)) * np.dtype(np.float32).itemsize)
+            self.observations = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf)
+            for row, remote in enumerate(self.remotes):
+                remote.send((self.shm.name, row, shape))
+            receive_all(self.remotes)
+        except Exception:
+            # the other workers may be waiting for the shared buffer
+            for process in self.processes:
+                process.terminate()
+            if self.shm is not None:
+                self.shm.close()
+                self.shm.unlink()
+            raise
+
+    def seed(self, seed):
+        for i, remote in enumerate(self.remotes):
+            remote.send(('seed', seed + i))
+        receive_all(self.remotes)
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        receive_all(self.remotes)
+        return self.observations, ''
+
+    def step_async(self, actions):
+        """Starts a step of all the envs, see step."""
+        assert (not self.waiting)
+        if actions is None:
+            actions = [None] * self.num_envs
+        for remote, action in zip(self.remotes, actions):
+            remote.send(('step', (action, self.auto_reset)))
+        self.waiting = True
+
+    def step_wait(self):
+        """Waits for the step started by step_async, returns the same as step."""
+        self.waiting = False
+        results = receive_all(self.remotes)
+        dones = np.array([done for done, _ in results])
+        infos = [info for _, info in results]
+        rewards = [info['reward_list'] for info in infos]
+        return self.observations, rewards, dones, infos
+
+    def step(self, actions):
+        """
+        actions is a sequence of num_envs actions as taken by STS2Environment.step, or None.
+
+        Returns (observations, rewards, dones, infos): observations is the shared buffer, rewards
+        a list of the per-player reward lists, dones a (num_envs,) array, and infos has one dict
+        per env as STS2Environment.step returns it: the GameEvents of the step in 'events' and,
+        with auto_reset, the last observation of a finished env in 'terminal_observation', the
+        returned one starting the next game. Each info also has the env's rewards in
+        'reward_list'.
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.waiting:
+            self.waiting = False
+            for remote in self.remotes:
+                try:
+                    remote.recv()
+                except EOFError:
+                    pass
+        for remote in self.remotes:
+            try:
+                remote.send(('close', None))
+            except (BrokenPipeError, EOFError):
+                # the worker already exited after an error
+                pass
+        for process in self.processes:
+            process.join()
+        self.observations = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -0,0 +1,51 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import numpy as np
+
+from sts2.client_adapter import ObservationMode
+from sts2.environment import STS2Environment
+from sts2.game.game_state import ArrayGameState, CodeNamedFields, GameState
+
+
+def play(state_cls, observation_mode):
+    env = STS2Environment(num_home_agents=1, timeout_ticks=150, state_cls=state_cls,
+                          observation_mode=observation_mode)
+    env.seed(3)
+    _, schema = env.reset()
+    steps = []
+    done = False
+    tick = 0
+    while not done:
+        action = {'h_ai_1': {'action': 'NONE', 'input': [np.sin(tick * 0.1), np.cos(tick * 0.07)]}}
+        observation, reward, done, _ = env.step(action)
+        if observation_mode == ObservationMode.FLAT:
+            observation = observation.copy()
+        steps.append((observation, reward))
+        tick += 1
+    return steps, schema
+
+
+def test_flat_matches_dict():
+    for state_cls in (GameState, ArrayGameState):
+        dict_steps, _ = play(state_cls, ObservationMode.DICT)
+        flat_steps, schema = play(state_cls, ObservationMode.FLAT)
+        assert len(dict_steps) == len(flat_steps)
+
+        score_prob_names = {prefix + schema.SCORE_PROB: name
+                            for name, prefix in schema.static['prefixes'].items()}
+        for (observation, reward), (flat_observation, flat_reward) in zip(dict_steps, flat_steps):
+            assert reward == flat_reward
+            # the dict has names where the flat vector has codes
+            values = CodeNamedFields(dict(observation))
+            for field, offset in schema.offsets.items():
+                if field in score_prob_names:
+                    value = observation['score_prob'][score_prob_names[field]]
+                else:
+                    value = values[field]
+                assert np.float32(value) == flat_observation[offset]
+            for field, value in schema.static.items():
+                assert observation[field] == value
+
+
+if __name__ == "__main__":
+    test_flat_matches_dict()
@@ -0,0 +1,37 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import numpy as np
+
+from sts2.environment import STS2Environment
+from sts2.game.game_state import Action, ArrayGameState, GameState
+from sts2.game.rules import PACMAN_GAME_RULES, Rules
+
+
+def test_turbo_matches_normal():
+    rng = np.random.RandomState(1)
+    actions = [(rng.randint(0, Action.NUM, 2), rng.uniform(-1, 1, (2, 2))) for _ in range(400)]
+    for rules in (None, PACMAN_GAME_RULES):
+        for state_cls in (GameState, ArrayGameState):
+            runs = []
+            for turbo in (False, True):
+                # games end on time up or with the first goal, and restart
+                env = STS2Environment(num_home_agents=1, num_away_agents=1, timeout_ticks=150,
+                                      state_cls=state_cls, rules=rules, turbo=turbo,
+                                      auto_reset=True, termination=Rules.Termination.EVERY_GOAL)
+                env.seed(5)
+                env.reset()
+                steps = []
+                for action in actions:
+                    observation, reward, done, info = env.step(action)
+                    events = [vars(event) for event in info['events']]
+                    steps.append((observation, reward, done, events,
+                                  list(env.game.player_action_list)))
+                runs.append(steps)
+            assert runs[0] == runs[1]
+            assert any(done for _, _, done, _, _ in runs[0])
+            # turbo doesn't record the state history
+            assert len(env.game.game_state_history) == 0
+
+
+if __name__ == "__main__":
+    test_turbo_matches_normal()
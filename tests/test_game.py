@@ -0,0 +1,101 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import random
+
+import numpy as np
+
+from sts2.environment import STS2Environment
+from sts2.game.game_state import ArrayGameState, GameState
+from sts2.game.rules import PACMAN_GAME_RULES
+from sts2.game.settings import TeamSide
+
+
+def rollout(game, num_ticks):
+    rows = []
+    for _ in range(num_ticks):
+        game.update(record_game_state=False)
+        rows.append(list(game.state.GetRow()))
+    return rows, [(event.tick, event.event_type) for event in game.game_event_history.event_list]
+
+
+def test_snapshot_restore():
+    for state_cls in (GameState, ArrayGameState):
+        env = STS2Environment(timeout_ticks=300, state_cls=state_cls)
+        env.seed(4)
+        env.reset()
+        for _ in range(50):
+            env.game.update()
+
+        # the rollout is replayed exactly from the snapshot, RNG states included
+        snapshot = env.game.SaveSnapshot()
+        rows, events = rollout(env.game, 100)
+        env.game.RestoreSnapshot(snapshot)
+        assert env.game.tick == 50
+        assert rollout(env.game, 100) == (rows, events)
+
+
+def test_clone():
+    for state_cls in (GameState, ArrayGameState):
+        env = STS2Environment(timeout_ticks=300, state_cls=state_cls)
+        env.seed(4)
+        env.reset()
+        for _ in range(50):
+            env.game.update()
+        row = list(env.game.state.GetRow())
+        num_recorded = len(env.game.game_state_history)
+
+        # the clone plays the same as the game from the same RNG states, without touching it
+        rng_states = random.getstate(), np.random.get_state()
+        clone = env.game.Clone()
+        clone_rollout = rollout(clone, 100)
+        assert list(env.game.state.GetRow()) == row
+        random.setstate(rng_states[0])
+        np.random.set_state(rng_states[1])
+        assert rollout(env.game, 100) == clone_rollout
+        assert len(env.game.game_state_history) == num_recorded
+
+
+def reference_crossover_constraint(game, positions):
+    # the per-player projection ApplyCrossoverConstraint replaced
+    constrained = []
+    for player, position in zip(game.players, positions):
+        x1 = 0.2
+        x2 = 0.6
+        y1 = 0.0
+        y2 = 1.0
+
+        # mirror for 2nd player
+        if player.GetTeamIndex(game) % 2:
+            x1, x2 = 1.0 - x1, 1.0 - x2
+
+        x, y = game.arena.GetNormalizedCoord(position)
+
+        if player.team_side == TeamSide.AWAY:
+            x, y = 1.0 - x, 1.0 - y
+
+        x_prime = x1 + (x2 - x1) * y / (y2 - y1)
+
+        if player.team_side == TeamSide.AWAY:
+            x_prime, y = 1.0 - x_prime, 1.0 - y
+
+        constrained.append(game.arena.GetArenaCoordFromNormalized(np.array([x_prime, y])))
+    return np.array(constrained)
+
+
+def test_crossover_constraint():
+    rng = np.random.default_rng(0)
+    env = STS2Environment(num_home_SimplePlayer=4, num_away_SimplePlayer=3, timeout_ticks=10,
+                          rules=PACMAN_GAME_RULES)
+    game = env.game
+    positions = rng.uniform(-1.0, 1.0, (20, len(game.players), 2)) * game.arena.maxs
+    expected = np.array([reference_crossover_constraint(game, row) for row in positions])
+
+    # bit for bit the same, for one state and for a batch of them
+    assert np.array_equal(game.ApplyCrossoverConstraint(positions[0]), expected[0])
+    assert np.array_equal(game.ApplyCrossoverConstraint(positions), expected)
+
+
+if __name__ == "__main__":
+    test_snapshot_restore()
+    test_clone()
+    test_crossover_constraint()
@@ -0,0 +1,46 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+from sts2.environment import STS2Environment
+from sts2.game.game_state import ArrayGameState, GameState
+
+
+def test_array_state_matches_series():
+    # the same seeded game on both backends gives the same observations, rewards and history
+    runs = []
+    for state_cls in (GameState, ArrayGameState):
+        env = STS2Environment(timeout_ticks=200, state_cls=state_cls)
+        env.seed(3)
+        env.reset()
+        steps = []
+        done = False
+        while not done:
+            observation, reward, done, _ = env.step(None)
+            steps.append((observation, reward))
+        runs.append((env.game, steps))
+
+    (series_game, series_steps), (array_game, array_steps) = runs
+    assert len(series_steps) == len(array_steps) == 201
+    for series_step, array_step in zip(series_steps, array_steps):
+        assert series_step == array_step
+
+    assert len(series_game.game_state_history) == len(array_game.game_state_history)
+    for series_entry, array_entry in zip(series_game.game_state_history,
+                                         array_game.game_state_history):
+        assert series_entry.state.index.tolist() == array_entry.state.index.tolist()
+        assert series_entry.state.tolist() == array_entry.state.tolist()
+        assert series_entry.player_action_list == array_entry.player_action_list
+
+
+def test_array_state_without_players():
+    states = []
+    for state_cls in (GameState, ArrayGameState):
+        env = STS2Environment(num_home_SimplePlayer=0, num_away_SimplePlayer=0,
+                              timeout_ticks=10, state_cls=state_cls)
+        states.append(env.game.state)
+    assert states[0].GetFieldNames() == states[1].GetFieldNames()
+    assert list(states[0].GetRow()) == list(states[1].GetRow())
+
+
+if __name__ == "__main__":
+    test_array_state_matches_series()
+    test_array_state_without_players()
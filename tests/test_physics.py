@@ -0,0 +1,172 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import copy
+
+import numpy as np
+
+from sts2.environment import STS2Environment
+from sts2.game.game_state import ArrayGameState, GameState
+from sts2.game.rules import PACMAN_GAME_RULES, STANDARD_GAME_RULES, Rules
+
+
+def reference_board_collisions(game, positions, velocities):
+    # the per-player loop BoardCollisionUpdate replaced
+    positions = positions.copy()
+    velocities = velocities.copy()
+    radius = game.rules.player_radius
+    min_x = game.arena.min_x + radius
+    max_x = game.arena.max_x - radius
+    min_z = game.arena.min_z + radius
+    max_z = game.arena.max_z - radius
+    for position, velocity in zip(positions, velocities):
+        if position[0] < min_x:
+            position[0] = min_x
+            velocity[0] = 0
+        if position[0] > max_x:
+            position[0] = max_x
+            velocity[0] = 0
+        if position[1] < min_z:
+            position[1] = min_z
+            velocity[1] = 0
+        if position[1] > max_z:
+            position[1] = max_z
+            velocity[1] = 0
+    return positions, velocities
+
+
+def test_board_collisions():
+    rng = np.random.default_rng(0)
+    for state_cls in (GameState, ArrayGameState):
+        env = STS2Environment(timeout_ticks=10, state_cls=state_cls)
+        env.reset()
+        game = env.game
+        for _ in range(100):
+            # about half of the players past the boards
+            positions = rng.uniform(-1.2, 1.2, (len(game.players), 2)) * game.arena.maxs
+            velocities = rng.normal(0.0, 0.5, (len(game.players), 2))
+            game.state.SetPlayerPositions(positions)
+            game.state.SetPlayerVelocities(velocities)
+
+            game.physics.BoardCollisionUpdate(0)
+            expected_positions, expected_velocities = reference_board_collisions(
+                game, positions, velocities)
+            assert np.array_equal(game.state.GetPlayerPositions(), expected_positions)
+            assert np.array_equal(game.state.GetPlayerVelocities(), expected_velocities)
+
+
+def reference_player_collisions(rules, positions, velocities):
+    # every unordered pair once, all tested on the start positions
+    start = positions
+    positions = positions.copy()
+    velocities = velocities.copy()
+    radius = rules.player_radius
+    pairs = [(i, j) for i in range(len(start)) for j in range(i + 1, len(start))]
+    distances = {(i, j): np.linalg.norm(start[i] - start[j]) for i, j in pairs}
+
+    for i, j in pairs:
+        dist = distances[i, j]
+        if 0.0 < dist <= radius * 4:
+            repulsion = (start[i] - start[j]) / dist * (0.1 / dist ** 3)
+            velocities[i] += repulsion
+            velocities[j] -= repulsion
+
+    if rules.enable_player_collisions:
+        resolved = [[] for _ in start]
+        for i, j in pairs:
+            dist = distances[i, j]
+            if dist <= radius * 2:
+                center = (start[i] + start[j]) * 0.5
+                avg_vel = (velocities[i] + velocities[j]) * 0.5
+                direction = (start[i] - start[j]) / dist if dist > 0.002 else np.array([1.0, 0.0])
+                resolved[i].append((center + direction * radius * 1.01, avg_vel))
+                resolved[j].append((center - direction * radius * 1.01, avg_vel))
+        for i, results in enumerate(resolved):
+            if results:
+                positions[i] = np.mean([position for position, _ in results], axis=0)
+                velocities[i] = np.mean([velocity for _, velocity in results], axis=0)
+    return positions, velocities
+
+
+def reference_sequential_collisions(rules, positions, velocities):
+    # the original loop over the ordered pairs, without the checks
+    positions = positions.copy()
+    velocities = velocities.copy()
+    radius = rules.player_radius
+    for i in range(len(positions)):
+        for j in range(len(positions)):
+            if i == j:
+                continue
+
+            if np.linalg.norm(positions[i] - positions[j]) <= radius * 4:
+                center = (positions[i] + positions[j]) * 0.5
+                for k in (i, j):
+                    delta = (positions[k] - center) * 2
+                    dist = np.linalg.norm(delta)
+                    velocities[k] = velocities[k] + delta / dist * (0.1 / (dist ** 3))
+
+            if np.linalg.norm(positions[i] - positions[j]) <= radius * 2 and \
+                    rules.enable_player_collisions:
+                center = (positions[i] + positions[j]) * 0.5
+                avg_vel = (velocities[i] + velocities[j]) * 0.5
+                for k in (i, j):
+                    delta = positions[k] - center
+                    dist = np.linalg.norm(delta)
+                    direction = delta / dist if dist > 0.001 else np.array([1.0, 0.0])
+                    positions[k] = center + direction * radius * 1.01
+                    velocities[k] = avg_vel
+    return positions, velocities
+
+
+def test_player_collisions():
+    rng = np.random.default_rng(1)
+    for base_rules in (STANDARD_GAME_RULES, PACMAN_GAME_RULES):
+        for collision_model, reference in (
+                (Rules.CollisionModel.VECTORIZED, reference_player_collisions),
+                (Rules.CollisionModel.SEQUENTIAL_PAIRS, reference_sequential_collisions)):
+            rules = copy.copy(base_rules)
+            rules.collision_model = collision_model
+            env = STS2Environment(timeout_ticks=10, rules=rules)
+            env.reset()
+            game = env.game
+            for _ in range(100):
+                # crowded, most players overlap or repulse some others
+                positions = rng.uniform(-2.0, 2.0, (len(game.players), 2))
+                velocities = rng.normal(0.0, 0.2, (len(game.players), 2))
+                game.state.SetPlayerPositions(positions)
+                game.state.SetPlayerVelocities(velocities)
+
+                game.physics.PlayerCollisionUpdate(0)
+                expected_positions, expected_velocities = reference(rules, positions, velocities)
+                if collision_model == Rules.CollisionModel.SEQUENTIAL_PAIRS:
+                    # bit for bit the same as the original loop
+                    assert np.array_equal(game.state.GetPlayerPositions(), expected_positions)
+                    assert np.array_equal(game.state.GetPlayerVelocities(), expected_velocities)
+                else:
+                    assert np.allclose(game.state.GetPlayerPositions(), expected_positions)
+                    assert np.allclose(game.state.GetPlayerVelocities(), expected_velocities)
+
+
+def test_spatial_hash_pairs():
+    rng = np.random.default_rng(2)
+    env = STS2Environment(timeout_ticks=10)
+    env.reset()
+    game = env.game
+    max_dist = game.rules.player_radius * 4
+
+    # a large roster at 3v3 density, jittered so some players change cell every query
+    positions = rng.uniform(-1.0, 1.0, (300, 2)) * game.arena.maxs * 7.0
+    for _ in range(50):
+        positions += rng.normal(0.0, 0.5, positions.shape)
+        pairs = []
+        for broadphase in (Rules.Broadphase.BRUTE_FORCE, Rules.Broadphase.SPATIAL_HASH):
+            game.rules.broadphase = broadphase
+            pairs.append(game.physics.FindClosePairs(positions, max_dist))
+        assert len(pairs[0][0]) > 0
+        for brute_force, spatial_hash in zip(*pairs):
+            assert np.array_equal(brute_force, spatial_hash)
+
+
+if __name__ == "__main__":
+    test_board_collisions()
+    test_player_collisions()
+    test_spatial_hash_pairs()
@@ -0,0 +1,38 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import numpy as np
+
+from sts2.environment import STS2Environment
+from sts2.game.game_state import ArrayGameState, GameState
+from sts2.game.player import Player
+from sts2.game.rules import PACMAN_GAME_RULES, STANDARD_GAME_RULES
+
+
+def test_motion_model_batch():
+    rng = np.random.default_rng(0)
+    for rules in (STANDARD_GAME_RULES, PACMAN_GAME_RULES):
+        for state_cls in (GameState, ArrayGameState):
+            env = STS2Environment(timeout_ticks=10, rules=rules, state_cls=state_cls)
+            env.reset()
+            game = env.game
+            num_players = len(game.players)
+            for _ in range(100):
+                positions = rng.uniform(-1.0, 1.0, (num_players, 2)) * game.arena.maxs
+                velocities = rng.normal(0.0, 0.4, (num_players, 2))
+                # some inputs over the unit length, some players in an action
+                inputs = rng.normal(0.0, 1.0, (num_players, 2))
+                action_times = rng.choice([0, 0, 5], num_players)
+
+                batch_positions, batch_velocities = Player.RunMotionModelBatch(
+                    game.rules, positions, velocities, inputs, action_times)
+
+                game.state.SetPlayerPositions(positions)
+                game.state.SetPlayerVelocities(velocities)
+                for player, input, action_time in zip(game.players, inputs, action_times):
+                    player.RunMotionModel(game, input.copy(), action_time)
+                assert np.array_equal(batch_positions, game.state.GetPlayerPositions())
+                assert np.array_equal(batch_velocities, game.state.GetPlayerVelocities())
+
+
+if __name__ == "__main__":
+    test_motion_model_batch()
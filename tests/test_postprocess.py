@@ -0,0 +1,48 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import os
+import tempfile
+
+import numpy as np
+
+from sts2.collect import collect
+from sts2.data.postprocess import postprocess_file, split_episodes
+from sts2.game.columnar_history import ColumnarStateHistory
+from sts2.game.game_state import GameState
+from sts2.game.settings import GamePhase
+
+
+def test_split_goal_game_over():
+    # a goal that doesn't end the game, then one that does, recorded with and without its
+    # STOPPAGE_GOAL state
+    ON, GOAL, OVER = GamePhase.GAME_ON, GamePhase.STOPPAGE_GOAL, GamePhase.GAME_OVER
+    phase = np.array([ON, ON, GOAL, ON, GOAL, OVER, ON, OVER])
+    previous_phase = np.array([ON, ON, ON, ON, ON, GOAL, ON, GOAL])
+    ticks = np.array([0, 1, 2, 3, 4, 5, 0, 1])
+    starts, ends, finished = split_episodes(phase, ticks, previous_phase)
+    assert starts.tolist() == [0, 3, 6]
+    assert ends.tolist() == [3, 6, 8]
+    assert finished.tolist() == [True, True, True]
+
+
+def test_collect_every_goal():
+    num_games = 3
+    with tempfile.TemporaryDirectory() as out_dir:
+        manifest = collect(num_games, 1, 'DATACOLLECTION_GAME_RULES', out_dir,
+                           env_kwargs={'termination': 'EVERY_GOAL'})
+        path = os.path.join(out_dir, manifest['shards'][0]['file'])
+        out_path = os.path.join(out_dir, 'processed.npz')
+        num_states, num_episodes = postprocess_file(path, out_path)
+        assert num_episodes == num_games
+        assert num_states == manifest['num_states']
+
+        history = ColumnarStateHistory(out_path)
+        for game in manifest['shards'][0]['games']:
+            last = game['first_state'] + game['num_states'] - 1
+            assert history.columns[GameState.CURRENT_PHASE][last] == GamePhase.GAME_OVER
+            assert history.columns[GameState.PREVIOUS_PHASE][last] == GamePhase.STOPPAGE_GOAL
+
+
+if __name__ == "__main__":
+    test_split_goal_game_over()
+    test_collect_every_goal()
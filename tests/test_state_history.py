@@ -0,0 +1,135 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import os
+import tempfile
+
+from sts2.environment import STS2Environment
+from sts2.game.columnar_history import ColumnarStateHistory
+from sts2.game.history_stream import HistoryStreamReader
+from sts2.game.simulation import HistoryMode
+
+
+def play(env, seed):
+    env.seed(seed)
+    env.reset()
+    while not env.game.IsSimulationComplete():
+        env.game.update()
+
+
+def record(out_dir, seed, **env_kwargs):
+    env = STS2Environment(timeout_ticks=300, history_spill_dir=out_dir, **env_kwargs)
+    play(env, seed)
+    return env.game.game_state_history
+
+
+def assert_same_states(history, copy_history):
+    assert len(history) == len(copy_history)
+    for entry, copy_entry in zip(history, copy_history):
+        assert entry.tick == copy_entry.tick
+        assert entry.state.index.tolist() == copy_entry.state.index.tolist()
+        assert entry.state.tolist() == copy_entry.state.tolist()
+
+
+def test_delta_matches_copy():
+    with tempfile.TemporaryDirectory() as out_dir:
+        copy_history = record(out_dir, 2)
+        history = record(out_dir, 2, history_mode=HistoryMode.DELTA)
+        assert_same_states(history, copy_history)
+        for entry, copy_entry in zip(history, copy_history):
+            assert entry.player_action_list == copy_entry.player_action_list
+            assert entry.player_reward_list == copy_entry.player_reward_list
+
+        # backwards, across the keyframes
+        for index in range(len(history) - 1, -1, -37):
+            assert history[index].state.tolist() == copy_history[index].state.tolist()
+
+
+def test_ring_matches_copy():
+    with tempfile.TemporaryDirectory() as out_dir:
+        copy_history = record(out_dir, 2)
+
+        # spilled to out_dir when full, all the entries stay readable
+        history = record(os.path.join(out_dir, 'spill'), 2, history_mode=HistoryMode.RING,
+                         history_capacity=64)
+        assert_same_states(history, copy_history)
+        for entry, copy_entry in zip(history, copy_history):
+            assert entry.player_action_list == copy_entry.player_action_list
+            assert entry.player_reward_list == copy_entry.player_reward_list
+            assert [policy.tolist() for policy in entry.player_policy_list] == \
+                   [policy.tolist() for policy in copy_entry.player_policy_list]
+
+        # without a spill directory, only the last capacity entries are kept
+        env = STS2Environment(timeout_ticks=300, history_mode=HistoryMode.RING,
+                              history_capacity=64)
+        play(env, 2)
+        assert_same_states(env.game.game_state_history, copy_history[-64:])
+
+
+def test_stream_matches_copy():
+    with tempfile.TemporaryDirectory() as out_dir:
+        copy_history = record(out_dir, 2)
+
+        # read back while recording, and from the closed file
+        history = record(os.path.join(out_dir, 'stream'), 2, history_mode=HistoryMode.STREAM,
+                         history_chunk_size=32)
+        assert_same_states(history, copy_history)
+        history.Close()
+        assert_same_states(HistoryStreamReader(history.path), copy_history)
+
+
+def test_load_reset_update():
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, 'STATEHISTORY.npz')
+        env = STS2Environment(timeout_ticks=50)
+        play(env, 0)
+        env.game.WriteStateHistory(path)
+
+        for mode in (HistoryMode.COPY, HistoryMode.DELTA, HistoryMode.RING, HistoryMode.STREAM):
+            env = STS2Environment(timeout_ticks=50, history_mode=mode, history_spill_dir=out_dir)
+            recorded = env.game.game_state_history
+            play(env, 1)
+
+            # the loaded history is shown until the game records again
+            env.game.LoadStateHistory(path)
+            assert isinstance(env.game.game_state_history, ColumnarStateHistory)
+            assert len(env.game.game_state_history) == 51
+            env.game.update()
+            assert env.game.game_state_history is recorded or mode == HistoryMode.COPY
+            assert len(env.game.game_state_history) == 52
+
+            env.game.LoadStateHistory(path)
+            env.reset()
+            for _ in range(10):
+                env.game.update()
+            assert env.game.game_state_history is recorded or mode == HistoryMode.COPY
+            assert len(env.game.game_state_history) == 10
+            assert [entry.tick for entry in env.game.game_state_history] == list(range(10))
+
+
+def test_load_stream_reset_update():
+    with tempfile.TemporaryDirectory() as out_dir:
+        env = STS2Environment(timeout_ticks=50, history_mode=HistoryMode.STREAM,
+                              history_spill_dir=os.path.join(out_dir, 'stream'))
+        play(env, 0)
+        path = env.game.game_state_history.path
+        env.game.game_state_history.Close()
+
+        env = STS2Environment(timeout_ticks=50, history_mode=HistoryMode.STREAM,
+                              history_spill_dir=out_dir)
+        recorded = env.game.game_state_history
+        env.game.LoadStateHistory(path)
+        assert isinstance(env.game.game_state_history, HistoryStreamReader)
+        assert len(env.game.game_state_history) == 51
+        env.reset()
+        for _ in range(10):
+            env.game.update()
+        assert env.game.game_state_history is recorded
+        assert [entry.tick for entry in env.game.game_state_history] == list(range(10))
+
+
+if __name__ == "__main__":
+    test_delta_matches_copy()
+    test_ring_matches_copy()
+    test_stream_matches_copy()
+    test_load_reset_update()
+    test_load_stream_reset_update()
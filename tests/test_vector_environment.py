@@ -0,0 +1,85 @@
+# Copyright (C) 2020 Electronic Arts Inc.  All rights reserved.
+
+import numpy as np
+
+from sts2.client_adapter import format_state
+from sts2.environment import STS2Environment
+from sts2.game.game_state import ArrayGameState
+from sts2.game.rules import Rules
+from sts2.game.settings import GamePhase, STS2Event
+from sts2.vector_environment import VectorSTS2Environment
+
+
+def test_vector_matches_single_envs():
+    num_envs = 3
+    env = VectorSTS2Environment(num_envs, timeout_ticks=200)
+    env.seed(0)
+    env.reset()
+    steps = []
+    for _ in range(300):
+        observations, rewards, dones, infos = env.step(None)
+        steps.append((observations.copy(), rewards, dones, infos))
+        if dones.all():
+            break
+    assert dones.all()
+
+    # the same games one by one, each stage run for all of them before the next stage as in
+    # the vector env, so they draw the same random numbers
+    single_envs = [STS2Environment(timeout_ticks=200, state_cls=ArrayGameState)
+                   for _ in range(num_envs)]
+    single_envs[0].seed(0)
+    for single_env in single_envs:
+        single_env.reset()
+
+    for observations, rewards, dones, infos in steps:
+        num_events = [len(single_env.game.game_event_history.event_list)
+                      for single_env in single_envs]
+        for single_env in single_envs:
+            single_env.game.client_adapter.receive_action(None)
+            single_env.game.BeginUpdate()
+            single_env.game.PreMotionUpdate(0)
+        for single_env in single_envs:
+            single_env.game.LocomotionUpdate(0)
+            single_env.game.physics.Update(0)
+        for single_env in single_envs:
+            single_env.game.PostMotionUpdate(0)
+            single_env.game.EndUpdate(False)
+
+        for row, single_env in enumerate(single_envs):
+            game = single_env.game
+            score_prob = format_state(game)['score_prob']
+            assert np.array_equal(observations[row], np.concatenate(
+                [game.state.values, [score_prob[player.name] for player in game.players]]))
+            assert rewards[row].tolist() == game.player_reward_list
+            assert dones[row] == game.IsSimulationComplete()
+            assert [vars(event) for event in infos[row]['events']] == \
+                   [vars(event) for event in game.game_event_history.event_list[num_events[row]:]]
+
+
+def test_every_goal_reset():
+    env = VectorSTS2Environment(2, termination=Rules.Termination.EVERY_GOAL, auto_reset=True,
+                                timeout_ticks=2000)
+    env.seed(1)
+    env.reset()
+    phase_column = env.observation_fields.index('current_phase')
+    previous_phase_column = env.observation_fields.index('previous_phase')
+    num_resets = 0
+    for _ in range(2000):
+        observations, rewards, dones, infos = env.step(None)
+        for row in np.flatnonzero(dones):
+            # the game ended one tick after its goal, and restarted in the same step
+            terminal = infos[row]['terminal_observation']
+            assert terminal[phase_column] == GamePhase.GAME_OVER
+            assert terminal[previous_phase_column] == GamePhase.STOPPAGE_GOAL
+            assert [event.event_type for event in infos[row]['events']] == [STS2Event.GAME_END]
+            assert env.games[row].tick == 0
+            assert observations[row, phase_column] == GamePhase.PRE_GAME
+            num_resets += 1
+        if num_resets >= 2:
+            break
+    assert num_resets >= 2
+
+
+if __name__ == "__main__":
+    test_vector_matches_single_envs()
+    test_every_goal_reset()